@@ -0,0 +1,121 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Pack a py_binary and its pip dependencies into a single file."""
+
+def _runfiles_path(workspace_name, short_path):
+  # Files of external repositories have short paths of the form
+  # ../repo/path, and live at repo/path in the runfiles tree.
+  if short_path.startswith("../"):
+    return short_path[len("../"):]
+  return workspace_name + "/" + short_path
+
+def _py_bundle_impl(ctx):
+  """Core implementation of py_bundle."""
+  binary = ctx.attr.binary
+  runfiles = binary.default_runfiles
+
+  lines = []
+  for f in runfiles.files.to_list():
+    if f == binary.files_to_run.executable:
+      # The launcher generated by Bazel, which the bundle replaces.
+      continue
+    lines.append("%s\t%s" % (
+        _runfiles_path(ctx.workspace_name, f.short_path), f.path))
+  for name in runfiles.empty_filenames.to_list():
+    if name.startswith("external/"):
+      name = "../" + name[len("external/"):]
+    lines.append("%s\t" % _runfiles_path(ctx.workspace_name, name))
+
+  manifest = ctx.actions.declare_file(ctx.label.name + ".manifest")
+  ctx.actions.write(manifest, "\n".join(lines) + "\n")
+
+  main = ctx.attr.main
+  if not main:
+    main = binary.label.name + ".py"
+  if binary.label.package:
+    main = binary.label.package + "/" + main
+  main = (binary.label.workspace_root or ctx.workspace_name) + "/" + main
+  if main.startswith("external/"):
+    main = main[len("external/"):]
+
+  args = [
+      "--output", ctx.outputs.executable.path,
+      "--manifest", manifest.path,
+      "--main", main,
+      "--workspace", ctx.workspace_name,
+      "--interpreter", ctx.attr.interpreter,
+  ]
+  if hasattr(binary, "py"):
+    args += ["--imports=%s" % path for path in binary.py.imports.to_list()]
+
+  ctx.actions.run(
+      executable = ctx.executable._bundletool,
+      arguments = args,
+      inputs = runfiles.files.to_list() + [manifest],
+      outputs = [ctx.outputs.executable],
+      mnemonic = "PyBundle",
+      progress_message = "Bundling %s" % binary.label,
+  )
+  return [DefaultInfo(executable = ctx.outputs.executable)]
+
+py_bundle = rule(
+    attrs = {
+        "binary": attr.label(
+            mandatory = True,
+            providers = ["py"],
+        ),
+        "main": attr.string(),
+        "interpreter": attr.string(default = "/usr/bin/env python"),
+        "_bundletool": attr.label(
+            executable = True,
+            default = Label("//rules_python:bundletool"),
+            cfg = "host",
+        ),
+    },
+    executable = True,
+    implementation = _py_bundle_impl,
+)
+
+"""A rule for packing a <code>py_binary</code> into a single executable file.
+
+The binary and everything in its runfiles, including the
+<code>whl_library</code> repositories of its <code>requirement()</code>
+dependencies, are written to one zipapp:
+<pre><code>load("@io_bazel_rules_python//python:bundle.bzl", "py_bundle")
+
+py_bundle(
+    name = "server_bundle",
+    binary = ":server",
+)
+</code></pre>
+
+Pure-Python modules are stored as uncompressed bytecode, which is imported
+directly from the bundle.  Import roots containing native extensions (e.g.
+<code>.so</code> files) or data files (e.g. <code>cacert.pem</code>) are
+extracted on first run into <code>$PY_BUNDLE_CACHE</code> (by default
+<code>~/.cache/py_bundle</code>), in a directory named by the hash of their
+content, and reused by later runs.
+
+The bytecode is compiled by the Python that runs the bundling tool, which
+must therefore be the same version as the one that runs the bundle.  A
+bundle run by any other version exits with an error saying so.
+
+Args:
+  binary: The <code>py_binary</code> to pack.
+
+  main: The main file of <code>binary</code>, relative to its package, if
+    that is not <code>&lt;name&gt;.py</code>.
+
+  interpreter: The interpreter for the shebang line of the bundle.
+"""
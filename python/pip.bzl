@@ -19,17 +19,34 @@ def _pip_import_impl_base(repository_ctx, python_binary):
   # Add an empty top-level BUILD file.
   # This is because Bazel requires BUILD files along all paths accessed
   # via //this/sort/of:path and we wouldn't be able to load our generated
-  # requirements.bzl without it.
+  # requirements.bzl without it.  piptool replaces it with one holding a
+  # py_library per requirement.
   repository_ctx.file("BUILD", "")
 
-  # To see the output, pass: quiet=False
-  result = repository_ctx.execute([
+  args = [
       python_binary, repository_ctx.path(repository_ctx.attr._script),
       "--name", repository_ctx.attr.name,
       "--input", repository_ctx.path(repository_ctx.attr.requirements),
       "--output", repository_ctx.path("requirements.bzl"),
       "--directory", repository_ctx.path(""),
-  ])
+  ]
+  if repository_ctx.attr.index_url:
+    args += ["--index_url", repository_ctx.attr.index_url]
+  if repository_ctx.attr.trusted_host:
+    args += ["--trusted_host", repository_ctx.attr.trusted_host]
+  for find_links in repository_ctx.attr.find_links:
+    args += ["--find_links", find_links]
+  if repository_ctx.attr.no_index:
+    args += ["--no_index"]
+  if repository_ctx.attr.wheel_cache:
+    args += ["--wheel_cache", repository_ctx.attr.wheel_cache]
+  if repository_ctx.attr.dedupe_native:
+    args += ["--dedupe_native"]
+  if repository_ctx.attr.trace:
+    args += ["--trace", repository_ctx.path("trace.json")]
+
+  # To see the output, pass: quiet=False
+  result = repository_ctx.execute(args)
 
   if result.return_code:
     fail("pip_import failed: %s (%s)" % (result.stdout, result.stderr))
@@ -47,6 +64,13 @@ pip_import = repository_rule(
             mandatory = True,
             single_file = True,
         ),
+        "index_url": attr.string(),
+        "trusted_host": attr.string(),
+        "find_links": attr.string_list(),
+        "no_index": attr.bool(default = False),
+        "wheel_cache": attr.string(),
+        "dedupe_native": attr.bool(default = False),
+        "trace": attr.bool(default = False),
         "_script": attr.label(
             executable = True,
             default = Label("//tools:piptool.par"),
@@ -63,6 +87,13 @@ pip3_import = repository_rule(
             mandatory = True,
             single_file = True,
         ),
+        "index_url": attr.string(),
+        "trusted_host": attr.string(),
+        "find_links": attr.string_list(),
+        "no_index": attr.bool(default = False),
+        "wheel_cache": attr.string(),
+        "dedupe_native": attr.bool(default = False),
+        "trace": attr.bool(default = False),
         "_script": attr.label(
             executable = True,
             default = Label("//tools:piptool.par"),
@@ -99,19 +130,53 @@ py_library(
 )
 </code></pre>
 
-Or alternatively:
-<pre><code>load("@foo//:requirements.bzl", "all_requirements")
+<code>requirement()</code> provides only the package itself.
+<code>pypi_requirement()</code> also provides the packages it depends on,
+transitively, and only the <code>whl_library</code> repositories of those
+are fetched and extracted by a build:
+<pre><code>load("@foo//:requirements.bzl", "pypi_requirement")
 py_binary(
     name = "baz",
     ...
     deps = [
-       ":foo",
-    ] + all_requirements,
+       pypi_requirement("requests[socks]"),
+    ],
 )
 </code></pre>
 
+<code>pypi_requirements()</code> and <code>pypi_whl_requirements()</code>
+provide every requirement, and all of the <code>.whl</code> files.
+
 Args:
   requirements: The label of a requirements.txt file.
+
+  index_url: The base URL of the package index to download from, e.g. a
+    local <code>wheelhouse_server</code>, instead of the one pip is
+    configured for.
+
+  trusted_host: The host of <code>index_url</code>, if pip should use it
+    though it is not served over HTTPS (e.g. a <code>wheelhouse_server</code>
+    on another machine).
+
+  find_links: Directories or URLs of archives in which to look for
+    requirements, e.g. a local wheelhouse.
+
+  no_index: Whether to ignore package indexes, and fetch requirements only
+    from <code>find_links</code>.  This works without network access.
+
+  wheel_cache: An absolute path of a directory in which to keep the
+    downloaded <code>.whl</code> files, shared by every
+    <code>pip_import</code> and <code>pip3_import</code> that names it.  A
+    wheel found there is not downloaded again, and it is hard linked into
+    this repository rather than copied.
+
+  dedupe_native: Whether the generated <code>whl_library</code> rules
+    should hard link identical native libraries across wheels (see
+    <code>whl_library</code>).
+
+  trace: Whether to write a Chrome trace of the import to
+    <code>trace.json</code> in this repository, and in each generated
+    <code>whl_library</code> repository.
 """
 
 def pip_repositories():
@@ -37,6 +37,12 @@ def _whl_impl_base(repository_ctx, python_binary):
         args += ["--extras=%s" % extra for extra in repository_ctx.attr.extras]
     if repository_ctx.attr.requirements:
         args += ["--requirements", repository_ctx.attr.requirements]
+    if repository_ctx.attr.dedupe_native:
+        # <output_base>/external/<name> -> <output_base>/rules_python_native
+        output_base = repository_ctx.path("").dirname.dirname
+        args += ["--native_store", "%s/rules_python_native" % output_base]
+    if repository_ctx.attr.trace:
+        args += ["--trace", repository_ctx.path("trace.json")]
 
     result = repository_ctx.execute(args, quiet=False)
     if result.return_code:
@@ -60,6 +66,8 @@ whl_library = repository_rule(
         ),
         "requirements": attr.string(),
         "extras": attr.string_list(),
+        "dedupe_native": attr.bool(default = False),
+        "trace": attr.bool(default = False),
         "_script": attr.label(
             executable = True,
             default = Label("//tools:whltool.par"),
@@ -81,6 +89,8 @@ whl3_library = repository_rule(
         ),
         "requirements": attr.string(),
         "extras": attr.string_list(),
+        "dedupe_native": attr.bool(default = False),
+        "trace": attr.bool(default = False),
         "_script": attr.label(
             executable = True,
             default = Label("//tools:whltool.par"),
@@ -105,7 +115,11 @@ This rule imports a <code>.whl</code> file as a <code>py_library</code>:
 </code></pre>
 
 This rule defines a <code>@foo//:pkg</code> <code>py_library</code> target and
-a <code>@foo//:whl</code> <code>filegroup</code> target.
+a <code>@foo//:whl</code> <code>filegroup</code> target.  <code>:pkg</code> is
+the union of the finer-grained <code>@foo//:py</code> <code>py_library</code>,
+which holds the Python sources and data files, and the
+<code>@foo//:native</code> <code>filegroup</code> of shared libraries and
+extension modules.
 
 Args:
   whls: The paths to the .whl files (the names are expected to follow [this
@@ -116,4 +130,11 @@ Args:
 
   extras: A subset of the "extras" available from these <code>.whl</code>s for
     which <code>requirements</code> has the dependencies.
+
+  dedupe_native: Whether to hard link the native libraries of the wheels
+    through a store shared by all repositories in the output base, so that
+    identical copies bundled by different wheels are kept only once on disk.
+
+  trace: Whether to write a Chrome trace of the expansion to
+    <code>trace.json</code> in this repository.
 """
@@ -0,0 +1,419 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Benchmarks piptool and whltool against synthetic wheelhouses.
+
+Each code path is timed over a wheelhouse of --wheels wheels and over one
+--scale times as large.  Absolute timings depend on the machine and on its
+load, but how they grow with the number of wheels does not, so that is what
+the benchmark checks: a code path whose time grows faster than
+wheels ** --max_exponent fails it.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import zipfile
+
+from rules_python import piptool
+from rules_python import whl
+
+_REPO_NAME = 'bench'
+
+# The time spent waiting for the disk varies too much from run to run to
+# measure scaling with; time.clock is the CPU time on Python 2.
+_cpu_time = getattr(time, 'process_time', None) or time.clock
+
+
+def main():
+    args = _parse_args()
+
+    sizes = [args.wheels, args.wheels * args.scale]
+    wheelhouse = tempfile.mkdtemp()
+    try:
+        wheelhouses = []
+        for size in sizes:
+            directory = os.path.join(wheelhouse, str(size))
+            os.mkdir(directory)
+            wheelhouses.append(
+                make_wheelhouse(
+                    directory=directory,
+                    count=size,
+                    files_per_wheel=args.files_per_wheel,
+                    file_size=args.file_size,
+                    extras_depth=args.extras_depth,
+                    extras_width=args.extras_width))
+        results = run_benchmarks(wheelhouses, repeat=args.repeat)
+    finally:
+        shutil.rmtree(wheelhouse, ignore_errors=True)
+
+    report = {
+        'config': {
+            'wheels': args.wheels,
+            'scale': args.scale,
+            'files_per_wheel': args.files_per_wheel,
+            'file_size': args.file_size,
+            'extras_depth': args.extras_depth,
+            'extras_width': args.extras_width,
+            'repeat': args.repeat,
+        },
+        'python': platform.python_version(),
+        'results': results,
+    }
+
+    content = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as file_obj:
+            file_obj.write(content + '\n')
+    else:
+        print(content)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as file_obj:
+            baseline = json.load(file_obj)
+        if baseline.get('config') != report['config']:
+            sys.stderr.write(
+                'The baseline was run with {}, not with {}; pass the same '
+                'flags to compare against it.\n'.format(
+                    json.dumps(baseline.get('config'), sort_keys=True),
+                    json.dumps(report['config'], sort_keys=True)))
+            sys.exit(1)
+    regressions = find_regressions(
+        report=report,
+        max_exponent=args.max_exponent,
+        baseline=baseline,
+        tolerance=args.tolerance)
+    for regression in regressions:
+        sys.stderr.write(
+            'REGRESSION: {name}: time grows as wheels ** {exponent:.2f}, '
+            'above {limit:.2f}\n'.format(**regression))
+    if regressions:
+        sys.exit(1)
+
+
+def make_wheelhouse(directory, count, files_per_wheel, file_size,
+                    extras_depth, extras_width):
+    """Writes a set of synthetic .whl files into directory.
+
+    The wheels form a tree through their extras: the extra "xK" of the
+    wheel at index I requires the wheel at index I * width + K + 1 (with the
+    same extra, if that wheel is not a leaf).  Children that fall outside of
+    count are simply missing, which exercises the unsatisfiable path of
+    the extras resolution.
+
+    Args:
+      directory: the directory into which to write the wheels.
+      count: the number of wheels to create.
+      files_per_wheel: the number of Python modules in each wheel.
+      file_size: the size in bytes of each module.
+      extras_depth: the number of levels of the extras tree.
+      extras_width: the number of extras declared by each non-leaf wheel.
+
+    Returns:
+      a list of whl.Wheel objects for the created files.
+    """
+    # Levels [0, extras_depth) of the tree declare extras.
+    with_extras = 0
+    level_size = 1
+    for _ in range(extras_depth):
+        with_extras += level_size
+        level_size *= max(extras_width, 1)
+
+    wheels = []
+    for index in range(count):
+        extras = {}
+        if index < with_extras:
+            for k in range(extras_width):
+                child = index * extras_width + k + 1
+                requirement = _synthetic_name(child)
+                if child < with_extras:
+                    requirement += '[x{}]'.format(k)
+                extras['x{}'.format(k)] = [requirement]
+        path = _make_synthetic_wheel(
+            directory=directory,
+            name=_synthetic_name(index),
+            files=files_per_wheel,
+            file_size=file_size,
+            extras=extras)
+        wheels.append(whl.Wheel(path))
+    return wheels
+
+
+def _synthetic_name(index):
+    return 'synth_pkg_{}'.format(index)
+
+
+def _make_synthetic_wheel(directory, name, files, file_size, extras):
+    version = '1.0.0'
+    dist_info = '{}-{}.dist-info'.format(name, version)
+    path = os.path.join(directory,
+                        '{}-{}-py2.py3-none-any.whl'.format(name, version))
+    run_requires = [{
+        'extra': extra,
+        'requires': requires
+    } for extra, requires in sorted(extras.items())]
+    metadata = {
+        'name': name,
+        'version': version,
+        'extras': sorted(extras),
+        'run_requires': run_requires,
+    }
+    body = ('#' * max(file_size - 1, 0) + '\n').encode('utf-8')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as whl_file:
+        for i in range(files):
+            whl_file.writestr('{}/module_{}.py'.format(name, i), body)
+        whl_file.writestr(dist_info + '/metadata.json', json.dumps(metadata))
+        whl_file.writestr(dist_info + '/METADATA',
+                          'Metadata-Version: 2.0\nName: {}\nVersion: {}\n'
+                          .format(name, version))
+        whl_file.writestr(dist_info + '/WHEEL',
+                          'Wheel-Version: 1.0\nRoot-Is-Purelib: true\n'
+                          'Tag: py2-none-any\nTag: py3-none-any\n')
+    return path
+
+
+def run_benchmarks(wheelhouses, repeat):
+    """Times the generation code paths over wheelhouses of different sizes.
+
+    The runs over the different wheelhouses are interleaved, so that they
+    all see the same load on the machine, and the exponent is that of the
+    CPU time of the process, which does not include waiting for the disk.
+
+    Args:
+      wheelhouses: lists of whl.Wheel objects, in increasing size.
+      repeat: the number of times to run each benchmark over each of them.
+
+    Returns:
+      a dict keyed by benchmark name, whose values hold the min, median
+      and mean wall-clock time and the min CPU time in seconds for each
+      wheelhouse size, and the exponent with which the min CPU time grows
+      with the size.
+    """
+    scratch = tempfile.mkdtemp()
+    try:
+        benchmarks = [
+            _make_benchmarks(wheels, scratch) for wheels in wheelhouses
+        ]
+        results = {}
+        for index, (name, _) in enumerate(benchmarks[0]):
+            times = [[] for _ in wheelhouses]
+            cpu_times = [[] for _ in wheelhouses]
+            for _ in range(repeat):
+                for size, size_benchmarks in enumerate(benchmarks):
+                    start = _cpu_time()
+                    times[size].append(
+                        timeit.timeit(size_benchmarks[index][1], number=1))
+                    cpu_times[size].append(_cpu_time() - start)
+            summaries = [
+                _summarize(size_times, size_cpu_times)
+                for size_times, size_cpu_times in zip(times, cpu_times)
+            ]
+            results[name] = {
+                'wheels': {
+                    str(len(wheels)): summary
+                    for wheels, summary in zip(wheelhouses, summaries)
+                },
+                'exponent': _exponent(
+                    len(wheelhouses[0]), summaries[0]['cpu_min'],
+                    len(wheelhouses[-1]), summaries[-1]['cpu_min']),
+            }
+        return results
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def _make_benchmarks(wheels, scratch):
+    def metadata():
+        for wheel in wheels:
+            wheel.metadata()
+
+    def wheel_to_extras():
+        piptool._make_wheel_to_extras(wheels)
+
+    def bzl_file_content():
+        piptool._make_bzl_file_content(
+            wheels=wheels,
+            reqs_repo_name=_REPO_NAME,
+            input_requirements_file_path='requirements.txt')
+
+    def expand():
+        directory = tempfile.mkdtemp(dir=scratch)
+        for wheel in wheels:
+            wheel.expand(directory)
+        shutil.rmtree(directory)
+
+    wheel_to_extras_result = piptool._make_wheel_to_extras(wheels)
+
+    def whl_main():
+        for wheel in wheels:
+            directory = tempfile.mkdtemp(dir=scratch)
+            argv = [
+                'whltool', '--whl_paths', wheel.path(), '--directory',
+                directory, '--track_deps', 'True', '--requirements',
+                '@{}//:requirements.bzl'.format(_REPO_NAME)
+            ]
+            argv += [
+                '--extras={}'.format(extra)
+                for extra in wheel_to_extras_result.get(wheel, [])
+            ]
+            _run_with_argv(whl.main, argv)
+            shutil.rmtree(directory)
+
+    return [
+        ('Wheel.metadata', metadata),
+        ('_make_wheel_to_extras', wheel_to_extras),
+        ('_make_bzl_file_content', bzl_file_content),
+        ('Wheel.expand', expand),
+        ('whl.main', whl_main),
+    ]
+
+
+def _exponent(small_size, small_time, large_size, large_time):
+    # The k for which large_time / small_time == (large_size / small_size)**k
+    if small_time <= 0 or large_time <= 0:
+        return 0.0
+    return math.log(large_time / small_time) / math.log(
+        float(large_size) / small_size)
+
+
+def _run_with_argv(func, argv):
+    saved_argv = sys.argv
+    sys.argv = argv
+    try:
+        func()
+    finally:
+        sys.argv = saved_argv
+
+
+def _summarize(times, cpu_times):
+    ordered = sorted(times)
+    return {
+        'min': ordered[0],
+        'median': ordered[len(ordered) // 2],
+        'mean': sum(ordered) / len(ordered),
+        'cpu_min': min(cpu_times),
+        'runs': len(ordered),
+    }
+
+
+def find_regressions(report, max_exponent, baseline=None, tolerance=0.0):
+    """Lists the benchmarks of report whose time grows too fast.
+
+    Args:
+      report: the current benchmark report.
+      max_exponent: the largest allowed exponent with which the time of a
+        benchmark grows with the number of wheels.
+      baseline: a previously written benchmark report, if any, whose
+        exponents plus tolerance also bound those of report.
+      tolerance: the allowed increase of an exponent over that of baseline.
+
+    Returns:
+      a list of dicts describing each benchmark that regressed.
+    """
+    regressions = []
+    for name, current in sorted(report['results'].items()):
+        limit = max_exponent
+        previous = (baseline or {}).get('results', {}).get(name)
+        if previous:
+            limit = min(limit, previous['exponent'] + tolerance)
+        if current['exponent'] > limit:
+            regressions.append({
+                'name': name,
+                'exponent': current['exponent'],
+                'limit': limit,
+            })
+    return regressions
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Benchmark piptool and whltool on synthetic wheels.')
+    parser.add_argument(
+        '--wheels',
+        action='store',
+        type=int,
+        default=100,
+        help='The number of wheels in the smaller wheelhouse.')
+    parser.add_argument(
+        '--scale',
+        action='store',
+        type=int,
+        default=4,
+        help='How many times larger the larger wheelhouse is.')
+    parser.add_argument(
+        '--files_per_wheel',
+        action='store',
+        type=int,
+        default=20,
+        help='The number of modules in each wheel.')
+    parser.add_argument(
+        '--file_size',
+        action='store',
+        type=int,
+        default=1024,
+        help='The size in bytes of each module.')
+    parser.add_argument(
+        '--extras_depth',
+        action='store',
+        type=int,
+        default=3,
+        help='The depth of the extras graph.')
+    parser.add_argument(
+        '--extras_width',
+        action='store',
+        type=int,
+        default=2,
+        help='The number of extras declared by each wheel in the graph.')
+    parser.add_argument(
+        '--repeat',
+        action='store',
+        type=int,
+        default=7,
+        help='The number of times to run each benchmark per wheelhouse.')
+    parser.add_argument(
+        '--output',
+        action='store',
+        default=None,
+        help='The JSON file to write results to; stdout if unset.')
+    parser.add_argument(
+        '--baseline',
+        action='store',
+        default=None,
+        help=('A previous JSON report, with whose exponents to check for '
+              'regressions as well.'))
+    parser.add_argument(
+        '--max_exponent',
+        action='store',
+        type=float,
+        default=1.5,
+        help=('The largest allowed exponent with which the time of a '
+              'benchmark grows with the number of wheels.'))
+    parser.add_argument(
+        '--tolerance',
+        action='store',
+        type=float,
+        default=0.3,
+        help='The allowed increase of an exponent over that of --baseline.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
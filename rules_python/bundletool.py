@@ -0,0 +1,339 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The bundletool module packs a py_binary's runfiles into one zipapp.
+
+Pure-Python files are stored as uncompressed bytecode at their runfiles
+paths, so that zipimport can load them straight out of the archive.  Import
+roots that contain native extensions cannot be imported from a zip, and
+those that ship data files may open them through __file__, so such roots
+are stored under _extract/ and extracted to a cache directory, keyed by
+their content hash, the first time the bundle runs.
+
+The bytecode only loads on the Python version that compiled it, which the
+bundle checks before importing anything.
+"""
+
+import argparse
+import binascii
+import hashlib
+import json
+import marshal
+import os
+import stat
+import struct
+import sys
+import textwrap
+import zipfile
+
+if sys.version_info < (3, 0):
+    import imp  # pylint: disable=W0402
+    _MAGIC = imp.get_magic()
+else:
+    import importlib.util
+    _MAGIC = importlib.util.MAGIC_NUMBER
+
+# A fixed timestamp keeps the bundle reproducible.
+_ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+_EXTRACT_PREFIX = '_extract'
+
+_NATIVE_SUFFIXES = ('.so', '.pyd', '.dylib')
+
+_CODE_SUFFIXES = ('.py', '.pyc', '.pyi')
+
+# Distribution metadata, which pkg_resources reads from zips as well.
+_METADATA_SUFFIXES = ('.dist-info', '.egg-info')
+
+
+def main():
+    args = _parse_args()
+    entries = _read_manifest(args.manifest)
+    write_bundle(
+        output=args.output,
+        entries=entries,
+        main=args.main,
+        workspace=args.workspace,
+        imports=args.imports,
+        interpreter=args.interpreter)
+
+
+def _read_manifest(path):
+    # Each line is "<runfiles path>\t<source path>", where an empty source
+    # path denotes an empty file (e.g. a generated __init__.py).
+    entries = []
+    with open(path, 'r') as file_obj:
+        for line in file_obj:
+            line = line.rstrip('\n')
+            if not line:
+                continue
+            runfiles_path, _, source = line.partition('\t')
+            entries.append((runfiles_path, source or None))
+    return entries
+
+
+def write_bundle(output, entries, main, workspace, imports, interpreter):
+    """Writes an executable zipapp of entries to output.
+
+    Args:
+      output: the path of the bundle to write.
+      entries: a list of (runfiles path, source path or None) tuples.
+      main: the runfiles path of the binary's main .py file.
+      workspace: the name of the binary's workspace.
+      imports: runfiles-relative import roots, in sys.path order.
+      interpreter: the interpreter for the bundle's shebang line.
+    """
+    roots = [workspace] + [root for root in imports if root != workspace]
+    extract_roots = set()
+    for runfiles_path, _ in entries:
+        root = _import_root(roots, runfiles_path)
+        if root is not None and _needs_extraction(
+                runfiles_path[len(root) + 1:]):
+            extract_roots.add(root)
+
+    digests = {root: hashlib.sha256() for root in extract_roots}
+    with open(output, 'wb') as file_obj:
+        file_obj.write('#!{}\n'.format(interpreter).encode('utf-8'))
+        with zipfile.ZipFile(file_obj, 'w') as bundle:
+            for runfiles_path, source in sorted(entries):
+                content = b''
+                if source is not None:
+                    with open(source, 'rb') as src:
+                        content = src.read()
+                mode = _mode(source)
+                root = _import_root(extract_roots, runfiles_path)
+                if root is not None:
+                    digest = digests[root]
+                    digest.update(runfiles_path.encode('utf-8') + b'\0')
+                    digest.update(content)
+                    _write(bundle, _EXTRACT_PREFIX + '/' + runfiles_path,
+                           content, mode, zipfile.ZIP_DEFLATED)
+                elif runfiles_path.endswith('.py'):
+                    code = _compile(content, runfiles_path)
+                    if code is None:
+                        _write(bundle, runfiles_path, content, mode,
+                               zipfile.ZIP_STORED)
+                    else:
+                        _write(bundle, runfiles_path + 'c', code, mode,
+                               zipfile.ZIP_STORED)
+                else:
+                    _write(bundle, runfiles_path, content, mode,
+                           zipfile.ZIP_DEFLATED)
+
+            config = {
+                'main': _module_name(roots, main),
+                'paths': roots,
+                'extract': {
+                    root: digest.hexdigest()
+                    for root, digest in digests.items()
+                },
+                'magic': binascii.hexlify(_MAGIC).decode('ascii'),
+                'python': '{}.{}'.format(*sys.version_info[:2]),
+            }
+            _write(bundle, '__main__.py',
+                   _BOOTSTRAP_TEMPLATE.format(
+                       config=json.dumps(config, sort_keys=True)).encode(
+                           'utf-8'), 0o644, zipfile.ZIP_STORED)
+    os.chmod(output, 0o755)
+
+
+def _needs_extraction(relative_path):
+    """Whether a file, relative to its import root, needs a real directory.
+
+    That is the case for native libraries, which cannot be loaded from a
+    zip, and for data files, which packages commonly open through their
+    __file__ (e.g. certifi's cacert.pem).
+    """
+    basename = os.path.basename(relative_path)
+    if basename.endswith(_NATIVE_SUFFIXES) or '.so.' in basename:
+        return True
+    if basename.endswith(_CODE_SUFFIXES):
+        return False
+    top = relative_path.split('/')[0]
+    return not top.endswith(_METADATA_SUFFIXES)
+
+
+def _import_root(roots, runfiles_path):
+    # The longest root containing runfiles_path, if any.
+    best = None
+    for root in roots:
+        if runfiles_path.startswith(root + '/'):
+            if best is None or len(root) > len(best):
+                best = root
+    return best
+
+
+def _module_name(roots, main):
+    root = _import_root(roots, main)
+    if root is None:
+        raise ValueError('{} is not within any of {}'.format(main, roots))
+    relative = main[len(root) + 1:]
+    if relative.endswith('.py'):
+        relative = relative[:-len('.py')]
+    return relative.replace('/', '.')
+
+
+def _mode(source):
+    if source is None:
+        return 0o644
+    return stat.S_IMODE(os.stat(source).st_mode)
+
+
+def _compile(content, runfiles_path):
+    """Compiles content to the bytes of a .pyc, or None if it won't compile.
+
+    There is no source in the bundle for zipimport to compare the .pyc
+    against, so the timestamp and size fields of the header are unused.
+    """
+    try:
+        code = compile(content, runfiles_path, 'exec', dont_inherit=True)
+    except (SyntaxError, TypeError, ValueError):
+        # e.g. modules of a py2.py3 wheel meant only for the other Python.
+        return None
+    if sys.version_info >= (3, 7):
+        # PEP 552 flags, then mtime and size.
+        header = struct.pack('<III', 0, 0, 0)
+    elif sys.version_info >= (3, 3):
+        header = struct.pack('<II', 0, 0)
+    else:
+        header = struct.pack('<I', 0)
+    return _MAGIC + header + marshal.dumps(code)
+
+
+def _write(bundle, name, content, mode, compress_type):
+    info = zipfile.ZipInfo(name, date_time=_ZIP_DATE_TIME)
+    info.external_attr = (stat.S_IFREG | mode) << 16
+    info.compress_type = compress_type
+    bundle.writestr(info, content)
+
+
+_BOOTSTRAP_TEMPLATE = textwrap.dedent("""\
+    # Generated by bundletool.
+    import binascii
+    import os
+    import runpy
+    import shutil
+    import sys
+    import tempfile
+    import zipfile
+
+    _CONFIG = {config}
+
+
+    def _cache_dir():
+        cache = os.environ.get('PY_BUNDLE_CACHE')
+        if not cache:
+            cache = os.path.join(
+                os.environ.get('XDG_CACHE_HOME') or
+                os.path.join(os.path.expanduser('~'), '.cache'), 'py_bundle')
+        return cache
+
+
+    def _magic():
+        try:
+            import importlib.util
+            return importlib.util.MAGIC_NUMBER
+        except (ImportError, AttributeError):
+            import imp
+            return imp.get_magic()
+
+
+    def _check_python():
+        # The modules are stored only as bytecode, which no other version of
+        # Python can load.
+        if binascii.hexlify(_magic()).decode('ascii') != _CONFIG['magic']:
+            sys.stderr.write(
+                'This bundle was built for Python {{}}, and cannot run on '
+                'Python {{}}.{{}} ({{}}); run it with Python {{}}, or '
+                'rebuild it with the Python that runs it.\\n'.format(
+                    _CONFIG['python'], sys.version_info[0],
+                    sys.version_info[1], sys.executable, _CONFIG['python']))
+            sys.exit(1)
+
+
+    def _extract(archive, root, digest):
+        target = os.path.join(_cache_dir(), digest)
+        if os.path.isdir(target):
+            return os.path.join(target, root)
+        if not os.path.isdir(_cache_dir()):
+            try:
+                os.makedirs(_cache_dir())
+            except OSError:
+                pass
+        tmpdir = tempfile.mkdtemp(dir=_cache_dir())
+        prefix = '_extract/' + root + '/'
+        with zipfile.ZipFile(archive) as bundle:
+            for info in bundle.infolist():
+                if not info.filename.startswith(prefix):
+                    continue
+                path = bundle.extract(info, tmpdir)
+                os.chmod(path, (info.external_attr >> 16) & 0o777)
+        try:
+            os.rename(os.path.join(tmpdir, '_extract'), target)
+        except OSError:
+            # Another process extracted the same content first.
+            pass
+        shutil.rmtree(tmpdir, ignore_errors=True)
+        return os.path.join(target, root)
+
+
+    def _main():
+        _check_python()
+        archive = os.path.dirname(os.path.abspath(__file__))
+        paths = []
+        for root in _CONFIG['paths']:
+            digest = _CONFIG['extract'].get(root)
+            if digest:
+                paths.append(_extract(archive, root, digest))
+            else:
+                paths.append(os.path.join(archive, root))
+        sys.path[1:1] = paths
+        runpy.run_module(_CONFIG['main'], run_name='__main__', alter_sys=True)
+
+
+    _main()
+""")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Pack a py_binary and its runfiles into one zipapp.')
+    parser.add_argument(
+        '--output', action='store', help='The bundle to write.')
+    parser.add_argument(
+        '--manifest',
+        action='store',
+        help='The file listing the runfiles to pack.')
+    parser.add_argument(
+        '--main',
+        action='store',
+        help='The runfiles path of the main .py file.')
+    parser.add_argument(
+        '--workspace',
+        action='store',
+        help='The name of the workspace of the binary.')
+    parser.add_argument(
+        '--imports',
+        action='append',
+        default=[],
+        help='A runfiles-relative import root of the binary.')
+    parser.add_argument(
+        '--interpreter',
+        action='store',
+        default='/usr/bin/env python',
+        help='The interpreter for the shebang line of the bundle.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
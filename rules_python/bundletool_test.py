@@ -0,0 +1,115 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from mock import patch
+
+from rules_python import bundletool
+
+
+class BundleToolTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.entries = []
+
+    def add_file(self, runfiles_path, content):
+        path = os.path.join(self.tmpdir, 'runfiles', runfiles_path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as file_obj:
+            file_obj.write(content)
+        self.entries.append((runfiles_path, path))
+
+    def test_bundle(self):
+        self.add_file('ws/app/main.py',
+                      'import pure, native, certs\n'
+                      'print(pure.__file__)\n'
+                      'print(native.__file__)\n'
+                      'print(open(certs.where()).read())\n')
+        self.entries.append(('ws/app/__init__.py', None))
+        self.add_file('pypi__pure_1_0/pure/__init__.py', '')
+        self.add_file('pypi__pure_1_0/pure-1.0.dist-info/METADATA',
+                      'Name: pure\n')
+        self.add_file('pypi__native_1_0/native/__init__.py', '')
+        self.add_file('pypi__native_1_0/native/.libs/libfoo.so.1', 'ELF')
+        # Like certifi, which requests uses for its CA bundle.
+        self.add_file(
+            'pypi__certs_1_0/certs/__init__.py', 'import os\n'
+            'def where():\n'
+            '    return os.path.join(os.path.dirname(__file__), "ca.pem")\n')
+        self.add_file('pypi__certs_1_0/certs/ca.pem', 'CERTIFICATE')
+
+        output = os.path.join(self.tmpdir, 'bundle.pyz')
+        bundletool.write_bundle(
+            output=output,
+            entries=self.entries,
+            main='ws/app/main.py',
+            workspace='ws',
+            imports=['pypi__pure_1_0', 'pypi__native_1_0', 'pypi__certs_1_0'],
+            interpreter=sys.executable)
+
+        with zipfile.ZipFile(output) as bundle:
+            names = set(bundle.namelist())
+            info = bundle.getinfo('pypi__pure_1_0/pure/__init__.pyc')
+            self.assertEqual(zipfile.ZIP_STORED, info.compress_type)
+        self.assertNotIn('pypi__pure_1_0/pure/__init__.py', names)
+        self.assertIn('ws/app/main.pyc', names)
+        self.assertIn('pypi__pure_1_0/pure-1.0.dist-info/METADATA', names)
+        self.assertIn('_extract/pypi__native_1_0/native/.libs/libfoo.so.1',
+                      names)
+        self.assertIn('_extract/pypi__certs_1_0/certs/ca.pem', names)
+
+        cache = os.path.join(self.tmpdir, 'cache')
+        env = dict(os.environ, PY_BUNDLE_CACHE=cache)
+        for _ in range(2):
+            output_lines = subprocess.check_output(
+                [output], env=env).decode('utf-8').splitlines()
+            self.assertEqual(
+                os.path.join(output, 'pypi__pure_1_0', 'pure',
+                             '__init__.pyc'), output_lines[0])
+            self.assertTrue(output_lines[1].startswith(cache))
+            self.assertEqual('CERTIFICATE', output_lines[2])
+        self.assertEqual(2, len(os.listdir(cache)))
+
+    def test_other_python(self):
+        self.add_file('ws/main.py', 'print("main")\n')
+        output = os.path.join(self.tmpdir, 'bundle.pyz')
+        # As if another version of Python had built the bundle.
+        with patch.object(bundletool, '_MAGIC', b'\x00\x00\r\n'):
+            bundletool.write_bundle(
+                output=output,
+                entries=self.entries,
+                main='ws/main.py',
+                workspace='ws',
+                imports=[],
+                interpreter=sys.executable)
+
+        process = subprocess.Popen(
+            [output], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        self.assertEqual(1, process.returncode)
+        self.assertEqual(b'', stdout)
+        self.assertIn('This bundle was built for Python',
+                      stderr.decode('utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
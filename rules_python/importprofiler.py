@@ -0,0 +1,283 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The importprofiler module ranks pip dependencies by their import cost.
+
+It runs a command (typically a built py_binary or py_test) with an import
+hook installed through a generated sitecustomize module, which records the
+time (and optionally the memory) spent executing each imported module.  The
+modules are then attributed to the whl_library repository they were loaded
+from, e.g. pypi__requests_2_18_4, by their file's runfiles path.  The hook
+requires Python 3.4 or later.
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+_OUTPUT_ENV = 'RULES_PYTHON_IMPORT_PROFILE'
+_MEMORY_ENV = 'RULES_PYTHON_IMPORT_PROFILE_MEMORY'
+
+_OTHER = '(not pip-provided)'
+
+# Matches the whl_library repository in a path within runfiles, which is
+# named <pip_import name>_pypi__<distribution>_<version>.
+_REPOSITORY_PATTERN = re.compile(r'([^/\\]*pypi__[^/\\]+)[/\\]')
+
+
+def main():
+    args = _parse_args()
+    records = profile(args.command, memory=args.memory)
+    if not records:
+        sys.stderr.write('No imports were recorded; the command must run '
+                         'Python 3.4 or later.\n')
+        sys.exit(1)
+    report = make_report(records)
+
+    if args.json:
+        with open(args.json, 'w') as file_obj:
+            json.dump(report, file_obj, indent=2, sort_keys=True)
+    print(format_report(report, top=args.top))
+
+
+def profile(command, memory=False):
+    """Runs command with the import hook installed.
+
+    Args:
+      command: the argv of the process to profile.
+      memory: whether to also trace memory allocated by each import.
+
+    Returns:
+      a list of the dicts recorded for each imported module, across the
+      command and any Python subprocesses it starts.
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        hook_dir = os.path.join(tmpdir, 'hook')
+        output_dir = os.path.join(tmpdir, 'output')
+        os.makedirs(hook_dir)
+        os.makedirs(output_dir)
+        with open(os.path.join(hook_dir, 'sitecustomize.py'), 'w') as hook:
+            hook.write(_HOOK)
+
+        env = dict(os.environ)
+        env[_OUTPUT_ENV] = output_dir
+        if memory:
+            env[_MEMORY_ENV] = '1'
+        pythonpath = env.get('PYTHONPATH')
+        env['PYTHONPATH'] = hook_dir + (os.pathsep + pythonpath
+                                        if pythonpath else '')
+        returncode = subprocess.call(command, env=env)
+        if returncode:
+            sys.stderr.write('{} exited with {}\n'.format(
+                command[0], returncode))
+
+        records = []
+        for fname in sorted(os.listdir(output_dir)):
+            with open(os.path.join(output_dir, fname), 'r') as file_obj:
+                records.extend(json.load(file_obj))
+        return records
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def repository_of(path):
+    """Returns the whl_library repository containing path, if any."""
+    match = _REPOSITORY_PATTERN.search(path or '')
+    if not match:
+        return _OTHER
+    return match.group(1)
+
+
+def make_report(records):
+    """Aggregates the per-module records by whl_library repository.
+
+    The cumulative cost of a repository counts only the imports of its
+    modules from outside of the repository, so that nested imports within
+    one wheel are not counted twice.
+
+    Returns:
+      a list of dicts, one per repository, ordered by decreasing cumulative
+      import time.
+    """
+    totals = {}
+    for record in records:
+        repository = repository_of(record['file'])
+        total = totals.setdefault(repository, {
+            'repository': repository,
+            'modules': 0,
+            'cumulative_us': 0,
+            'self_us': 0,
+            'cumulative_bytes': 0,
+            'self_bytes': 0,
+        })
+        total['modules'] += 1
+        total['self_us'] += record['self_us']
+        total['self_bytes'] += record.get('self_bytes') or 0
+        if repository_of(record['parent_file']) != repository:
+            total['cumulative_us'] += record['cumulative_us']
+            total['cumulative_bytes'] += record.get('cumulative_bytes') or 0
+    return sorted(
+        totals.values(),
+        key=lambda total: (-total['cumulative_us'], total['repository']))
+
+
+def format_report(report, top=None):
+    lines = [
+        '{:>12} {:>12} {:>12} {:>8}  {}'.format(
+            'cumul. ms', 'self ms', 'memory KiB', 'modules', 'repository')
+    ]
+    for total in report[:top]:
+        lines.append('{:12.1f} {:12.1f} {:12.1f} {:8d}  {}'.format(
+            total['cumulative_us'] / 1000.0, total['self_us'] / 1000.0,
+            total['cumulative_bytes'] / 1024.0, total['modules'],
+            total['repository']))
+    return '\n'.join(lines)
+
+
+# The import hook wraps the exec_module of each loader it finds, rather than
+# the loader itself, so that module.__loader__ keeps its type (pkg_resources
+# dispatches on it).  Loaders may be shared by many modules (e.g. a
+# zipimporter), so each is wrapped only once, and the wrapper takes the name
+# from the module it executes.
+_HOOK = textwrap.dedent("""\
+    # Generated by importprofiler.
+    import atexit
+    import json
+    import os
+    import sys
+    import time
+
+    # These are inherited by subprocesses, which are profiled too.
+    _OUTPUT_DIR = os.environ.get('{output_env}')
+    _MEMORY = os.environ.get('{memory_env}')
+    if _OUTPUT_DIR and _MEMORY:
+        import tracemalloc
+        tracemalloc.start()
+
+        def _memory():
+            return tracemalloc.get_traced_memory()[0]
+    else:
+
+        def _memory():
+            return 0
+
+    _RECORDS = []
+    _STACK = []
+
+
+    def _timed(exec_module):
+        def wrapper(module):
+            name = module.__name__
+            parent_file = _STACK[-1][0] if _STACK else None
+            # The file, and the time and memory of nested imports.
+            frame = [getattr(module, '__file__', None), 0, 0]
+            _STACK.append(frame)
+            start = time.time()
+            start_memory = _memory()
+            try:
+                return exec_module(module)
+            finally:
+                _STACK.pop()
+                cumulative = time.time() - start
+                cumulative_bytes = _memory() - start_memory
+                _RECORDS.append({{
+                    'name': name,
+                    'file': frame[0],
+                    'parent_file': parent_file,
+                    'cumulative_us': int(cumulative * 1e6),
+                    'self_us': int((cumulative - frame[1]) * 1e6),
+                    'cumulative_bytes': cumulative_bytes,
+                    'self_bytes': cumulative_bytes - frame[2],
+                }})
+                if _STACK:
+                    _STACK[-1][1] += cumulative
+                    _STACK[-1][2] += cumulative_bytes
+        wrapper.timed = True
+        return wrapper
+
+
+    class _Finder(object):
+        def find_spec(self, fullname, path, target=None):
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is None:
+                    continue
+                loader = spec.loader
+                # Builtin and frozen importers are classes shared by all of
+                # their modules; leave them be.
+                if (loader is not None and not isinstance(loader, type) and
+                        hasattr(loader, 'exec_module') and
+                        not getattr(loader.exec_module, 'timed', False)):
+                    try:
+                        loader.exec_module = _timed(loader.exec_module)
+                    except (AttributeError, TypeError):
+                        # e.g. the loader is of a type implemented in C.
+                        pass
+                return spec
+            return None
+
+
+    def _write():
+        path = os.path.join(_OUTPUT_DIR, '%d.json' % os.getpid())
+        with open(path, 'w') as file_obj:
+            json.dump(_RECORDS, file_obj)
+
+
+    if _OUTPUT_DIR and sys.version_info >= (3, 4):
+        sys.meta_path.insert(0, _Finder())
+        atexit.register(_write)
+""").format(
+    output_env=_OUTPUT_ENV, memory_env=_MEMORY_ENV)
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Rank pip dependencies by the cost of importing them.')
+    parser.add_argument(
+        '--memory',
+        action='store_true',
+        help='Also trace the memory allocated by imports (slower).')
+    parser.add_argument(
+        '--json',
+        action='store',
+        default=None,
+        help='The file to which to write the report as JSON.')
+    parser.add_argument(
+        '--top',
+        action='store',
+        type=int,
+        default=None,
+        help='The number of repositories to print.')
+    parser.add_argument(
+        'command',
+        nargs=argparse.REMAINDER,
+        help='The command to profile, e.g. bazel-bin/path/to/binary.')
+    args = parser.parse_args()
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+    if not args.command:
+        parser.error('a command to profile is required')
+    return args
+
+
+if __name__ == '__main__':
+    main()
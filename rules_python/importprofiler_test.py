@@ -0,0 +1,108 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import zipfile
+
+from rules_python import importprofiler
+
+
+class ImportProfilerTest(unittest.TestCase):
+    def test_repository_of(self):
+        self.assertEqual(
+            'deps_pypi__six_1_11_0',
+            importprofiler.repository_of(
+                '/x/bin.runfiles/deps_pypi__six_1_11_0/six.py'))
+        self.assertEqual('(not pip-provided)',
+                         importprofiler.repository_of('/usr/lib/json.py'))
+        self.assertEqual('(not pip-provided)',
+                         importprofiler.repository_of(None))
+
+    def test_make_report(self):
+        records = [
+            {
+                'file': 'r/pypi__a/a/__init__.py',
+                'parent_file': None,
+                'cumulative_us': 100,
+                'self_us': 40,
+            },
+            {
+                'file': 'r/pypi__a/a/util.py',
+                'parent_file': 'r/pypi__a/a/__init__.py',
+                'cumulative_us': 50,
+                'self_us': 50,
+            },
+            {
+                'file': 'r/pypi__b/b.py',
+                'parent_file': 'r/pypi__a/a/__init__.py',
+                'cumulative_us': 10,
+                'self_us': 10,
+            },
+        ]
+        report = importprofiler.make_report(records)
+        self.assertEqual(['pypi__a', 'pypi__b'],
+                         [total['repository'] for total in report])
+        self.assertEqual(100, report[0]['cumulative_us'])
+        self.assertEqual(90, report[0]['self_us'])
+        self.assertEqual(2, report[0]['modules'])
+        self.assertEqual(10, report[1]['cumulative_us'])
+
+    @unittest.skipIf(sys.version_info < (3, 4), 'the hook needs Python 3.4')
+    def test_profile(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        package = os.path.join(tmpdir, 'deps_pypi__slow_1_0', 'slow')
+        os.makedirs(package)
+        with open(os.path.join(package, '__init__.py'), 'w') as file_obj:
+            file_obj.write('import time\ntime.sleep(0.05)\n')
+
+        records = importprofiler.profile([
+            sys.executable, '-c',
+            'import sys; sys.path.insert(0, %r); import slow' %
+            os.path.dirname(package)
+        ])
+        report = importprofiler.make_report(records)
+        self.assertEqual('deps_pypi__slow_1_0', report[0]['repository'])
+        self.assertGreaterEqual(report[0]['cumulative_us'], 50000)
+
+    @unittest.skipIf(sys.version_info < (3, 10),
+                     'zipimport has exec_module as of Python 3.10')
+    def test_profile_shared_loader(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        archive = os.path.join(tmpdir, 'deps_pypi__zipped_1_0.zip')
+        with zipfile.ZipFile(archive, 'w') as zip_file:
+            zip_file.writestr('zipped/__init__.py',
+                              'from zipped import a\nfrom zipped import b\n')
+            zip_file.writestr('zipped/a.py', '')
+            zip_file.writestr('zipped/b.py', '')
+
+        records = importprofiler.profile([
+            sys.executable, '-c',
+            'import sys; sys.path.insert(0, %r); import zipped' % archive
+        ])
+        records = dict((record['name'], record) for record in records
+                       if record['name'].startswith('zipped'))
+        self.assertEqual(['zipped', 'zipped.a', 'zipped.b'], sorted(records))
+        for name in ['zipped.a', 'zipped.b']:
+            self.assertEqual(records['zipped']['file'],
+                             records[name]['parent_file'])
+
+
+if __name__ == '__main__':
+    unittest.main()
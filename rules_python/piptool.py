@@ -15,6 +15,11 @@
 
 import argparse
 import atexit
+import contextlib
+import errno
+import hashlib
+import json
+import logging
 import os
 import pkgutil
 # import pkg_resources
@@ -22,6 +27,13 @@ import shutil
 import sys
 import tempfile
 import textwrap
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no flock; the wheel cache then goes unlocked.
+    fcntl = None
 
 # Note: We carefully import the following modules in a particular
 # order, since these modules modify the import path and machinery.
@@ -61,7 +73,10 @@ def _extract_packages(package_names):
 # Wheel, pip, and setuptools are much happier running from actual
 # files on disk, rather than entries in a zipfile.  Extract zipfile
 # contents, add those contents to the path, then import them.
+# This happens before we parse flags, so remember when for --trace.
+_EXTRACT_START = time.time()
 _extract_packages(['pip', 'setuptools', 'wheel'])
+_EXTRACT_END = time.time()
 
 # Defeat pip's attempt to mangle sys.path
 _SAVED_SYS_PATH = sys.path
@@ -73,42 +88,277 @@ sys.path = _SAVED_SYS_PATH
 # import wheel
 
 
-def _pip_main(argv):
-    # Extract the certificates from the PAR following the example of get-pip.py
-    # https://github.com/pypa/get-pip/blob/430ba37776ae2ad89/template.py#L164-L168
-    cert_path = os.path.join(tempfile.mkdtemp(), "cacert.pem")
-    with open(cert_path, "wb") as cert:
-        cert.write(pkgutil.get_data("pip._vendor.requests", "cacert.pem"))
-    argv = ["--disable-pip-version-check", "--cert", cert_path] + argv
-    return pip.main(argv)
+def _pip_main(argv, offline=False):
+    options = ["--disable-pip-version-check"]
+    # Only remote indexes need certificates.
+    if not offline:
+        # Extract the certificates from the PAR following the example of
+        # get-pip.py
+        # https://github.com/pypa/get-pip/blob/430ba37776ae2ad89/template.py#L164-L168
+        cert_dir = tempfile.mkdtemp()
+        atexit.register(lambda: shutil.rmtree(cert_dir, ignore_errors=True))
+        cert_path = os.path.join(cert_dir, "cacert.pem")
+        with open(cert_path, "wb") as cert:
+            cert.write(pkgutil.get_data("pip._vendor.requests", "cacert.pem"))
+        options += ["--cert", cert_path]
+    return pip.main(options + argv)
 
 
-from rules_python.whl import Wheel  # pylint: disable=C0413
+from rules_python.tracing import Tracer  # pylint: disable=C0413
+from rules_python.whl import (  # pylint: disable=C0413
+    Wheel, inspect_wheels, normalize_name, select_wheels)
 
 
 def main():
     args = _parse_args()
+    tracer = Tracer(args.trace)
+    tracer.add_span('extract_packages', _EXTRACT_START, _EXTRACT_END)
+    try:
+        _import_requirements(args, tracer)
+    finally:
+        tracer.write()
+
+
+def _import_requirements(args, tracer):
+    # pip writes into a fresh directory, so that .whl files left in
+    # --directory by earlier runs can be told apart and pruned.
+    staging_dir = tempfile.mkdtemp(dir=args.directory)
+    try:
+        wheels = _download_wheels(args, tracer, staging_dir)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if args.inspect:
+        with tracer.span('inspect', wheels=len(wheels)):
+            with open(args.inspect, 'w') as file_obj:
+                json.dump(
+                    inspect_wheels(wheels), file_obj, indent=2, sort_keys=True)
+
+    with tracer.span('extras_resolution', wheels=len(wheels)):
+        wheel_to_extras = _make_wheel_to_extras(wheels, tracer)
+
+    with tracer.span('generate_bzl', wheels=len(wheels)) as span_args:
+        with open(args.output, 'w') as file_obj:
+            _write_bzl_file(
+                file_obj.write,
+                wheels=wheels,
+                reqs_repo_name=args.name,
+                input_requirements_file_path=args.input,
+                tracer=tracer,
+                dedupe_native=args.dedupe_native,
+                wheel_to_extras=wheel_to_extras)
+            span_args['bytes'] = file_obj.tell()
+
+    with tracer.span('generate_build', wheels=len(wheels)) as span_args:
+        with open(os.path.join(args.directory, 'BUILD'), 'w') as file_obj:
+            _write_build_file(
+                file_obj.write,
+                wheels=wheels,
+                reqs_repo_name=args.name,
+                input_requirements_file_path=args.input,
+                wheel_to_extras=wheel_to_extras)
+            span_args['bytes'] = file_obj.tell()
+
+
+def _download_wheels(args, tracer, staging_dir):
+    pip_args = ["wheel", "-w", staging_dir, "-r", args.input]
+    if args.index_url:
+        pip_args += ["--index-url", args.index_url]
+    if args.trusted_host:
+        pip_args += ["--trusted-host", args.trusted_host]
+    if args.no_index:
+        pip_args += ["--no-index"]
+    for find_links in args.find_links:
+        pip_args += ["--find-links", find_links]
+    if args.wheel_cache:
+        # pip prefers local archives to equally good ones on an index, so
+        # that cached wheels are not downloaded again.
+        pip_args += ["--find-links", _cache_subdirectory(args.wheel_cache,
+                                                         'wheels')]
+
+    # pip resolves, downloads and builds within a single call, so this is
+    # traced as one span, split up by the progress pip logs.
+    with tracer.span('pip_wheel', input=args.input):
+        progress = _PipProgress(tracer)
+        pip_logger = logging.getLogger('pip')
+        pip_logger.addHandler(progress)
+        try:
+            # https://github.com/pypa/pip/blob/9.0.1/pip/__init__.py#L209
+            status = _pip_main(pip_args, offline=args.no_index)
+        finally:
+            pip_logger.removeHandler(progress)
+            progress.finish()
+        if status:
+            sys.exit(1)
+
+    with tracer.span('select_wheels') as span_args:
+        for path in _list_whl_files(args.directory, exclude=staging_dir):
+            print('Removing stale {}'.format(os.path.basename(path)))
+            os.remove(path)
+
+        selected, rejected = select_wheels(
+            [Wheel(path) for path in _list_whl_files(staging_dir)],
+            supported_tags=_supported_tags())
+        for wheel, reason in rejected:
+            print('Ignoring {}: {}'.format(wheel.basename(), reason))
+        span_args['selected'] = len(selected)
+        span_args['rejected'] = len(rejected)
+
+    if args.wheel_cache:
+        with tracer.span('cache_wheels', wheels=len(selected)):
+            return _cache_wheels(args.wheel_cache, selected, args.directory,
+                                 tracer)
+
+    wheels = []
+    for wheel in selected:
+        path = os.path.join(args.directory, wheel.basename())
+        shutil.move(wheel.path(), path)
+        wheels.append(Wheel(path))
+    return wheels
+
+
+def _cache_wheels(cache_dir, wheels, directory, tracer=None):
+    """Adds wheels to the wheel cache, and links them into directory.
+
+    The cache keeps each distinct .whl file once, at
+    sha256/<digest>/<filename>, and links the first one of each filename
+    into wheels/, which pip searches with --find-links.  It is shared by
+    every pip_import on the host that points at it, across processes, which
+    take turns through a lock file.  Wheels that cannot be hard linked
+    (e.g. across file systems) are copied instead.
 
-    # https://github.com/pypa/pip/blob/9.0.1/pip/__init__.py#L209
-    if _pip_main(["wheel", "-w", args.directory, "-r", args.input]):
-        sys.exit(1)
-
-    # Enumerate the .whl files we downloaded.
-    def list_whl_files():
-        dir_ = args.directory + '/'
-        for root, unused_dirnames, filenames in os.walk(dir_):
-            for fname in filenames:
-                if fname.endswith('.whl'):
-                    yield os.path.join(root, fname)
+    Args:
+      cache_dir: the directory of the cache.
+      wheels: a list of Wheel objects, whose files are moved into the cache.
+      directory: the directory into which to link the cached wheels.
+      tracer: a Tracer for the hashing and linking of each wheel.
 
-    wheels = [Wheel(path) for path in list_whl_files()]
+    Returns:
+      a list of the Wheel objects of the links in directory.
+    """
+    tracer = tracer or Tracer()
+    linked = []
+    with _locked(cache_dir):
+        for wheel in wheels:
+            with tracer.span(
+                    wheel.basename(),
+                    category='cache',
+                    bytes=os.path.getsize(wheel.path())):
+                cached = os.path.join(
+                    _cache_subdirectory(cache_dir, 'sha256',
+                                        _sha256(wheel.path())),
+                    wheel.basename())
+                if not os.path.exists(cached):
+                    shutil.move(wheel.path(), cached)
+                find_links_path = os.path.join(
+                    _cache_subdirectory(cache_dir, 'wheels'),
+                    wheel.basename())
+                if not os.path.exists(find_links_path):
+                    _link(cached, find_links_path)
+                path = os.path.join(directory, wheel.basename())
+                _link(cached, path)
+                linked.append(Wheel(path))
+    return linked
+
+
+def _cache_subdirectory(cache_dir, *names):
+    path = os.path.join(cache_dir, *names)
+    if not os.path.isdir(path):
+        try:
+            os.makedirs(path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    return path
+
+
+@contextlib.contextmanager
+def _locked(cache_dir):
+    with open(os.path.join(_cache_subdirectory(cache_dir), 'lock'),
+              'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        # Closing the file releases the lock.
+        yield
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file_obj:
+        for chunk in iter(lambda: file_obj.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _link(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+
+class _PipProgress(logging.Handler):
+    """Traces each requirement pip collects, and each wheel it builds.
+
+    pip logs a message as it starts on each of these steps, which are taken
+    one at a time, so each step's span lasts until the next one starts.
+    """
 
-    bzl_file_content = _make_bzl_file_content(
-        wheels=wheels,
-        reqs_repo_name=args.name,
-        input_requirements_file_path=args.input)
-    with open(args.output, 'w') as file_obj:
-        file_obj.write(bzl_file_content)
+    _STEPS = ('Collecting ', 'Building wheel for ',
+              'Running setup.py bdist_wheel for ')
+
+    def __init__(self, tracer):
+        logging.Handler.__init__(self)
+        self._tracer = tracer
+        self._step = None
+
+    def emit(self, record):
+        message = record.getMessage().strip()
+        if message.startswith(self._STEPS):
+            self.finish(record.created)
+            self._step = (message, record.created)
+
+    def finish(self, end=None):
+        """Ends the span of the current step, if any."""
+        if self._step is not None:
+            name, start = self._step
+            self._tracer.add_span(
+                name, start, end or time.time(), category='pip')
+            self._step = None
+
+
+def _list_whl_files(directory, exclude=None):
+    # Enumerate the .whl files under directory.
+    for root, dirnames, filenames in os.walk(directory):
+        if exclude:
+            dirnames[:] = [
+                dirname for dirname in dirnames
+                if os.path.join(root, dirname) != exclude
+            ]
+        for fname in filenames:
+            if fname.endswith('.whl'):
+                yield os.path.join(root, fname)
+
+
+def _supported_tags():
+    # The (python, abi, platform) tags of this interpreter, most preferred
+    # first.
+    # pylint: disable=E0401,E0611
+    try:
+        # pip < 10
+        from pip import pep425tags
+    except ImportError:
+        try:
+            # pip >= 10, < 20.1
+            from pip._internal import pep425tags
+        except ImportError:
+            from pip._internal.utils import compatibility_tags as pep425tags
+    # pip >= 20 returns packaging.tags.Tag objects rather than tuples.
+    return [
+        tag if isinstance(tag, tuple) else
+        (tag.interpreter, tag.abi, tag.platform)
+        for tag in pep425tags.get_supported()
+    ]
 
 
 def _parse_args():
@@ -126,83 +376,145 @@ def _parse_args():
         '--directory',
         action='store',
         help='The directory into which to put .whl files.')
+    parser.add_argument(
+        '--index_url',
+        action='store',
+        default=None,
+        help=('The base URL of the package index to use instead of the one '
+              'pip is configured for, e.g. a local wheelhouse_server.'))
+    parser.add_argument(
+        '--trusted_host',
+        action='store',
+        default=None,
+        help=('A host to trust though it is not served over HTTPS, e.g. '
+              'that of a local wheelhouse_server.'))
+    parser.add_argument(
+        '--find_links',
+        action='append',
+        default=[],
+        help='A directory or URL of archives to look for requirements in.')
+    parser.add_argument(
+        '--no_index',
+        action='store_true',
+        help='Ignore package indexes, using only --find_links.')
+    parser.add_argument(
+        '--wheel_cache',
+        action='store',
+        default=None,
+        help=('A directory in which to share downloaded .whl files with '
+              'other imports, which are linked from there.'))
+    parser.add_argument(
+        '--inspect',
+        action='store',
+        default=None,
+        help=('The file to which to write the sizes of the contents of the '
+              'downloaded .whl files, as JSON.'))
+    parser.add_argument(
+        '--dedupe_native',
+        action='store_true',
+        help=('Have the generated whl_library rules hard link identical '
+              'native libraries across wheels.'))
+    parser.add_argument(
+        '--trace',
+        action='store',
+        default=None,
+        help='The file to which to write a Chrome trace of the import.')
     return parser.parse_args()
 
 
-def _make_bzl_file_content(wheels, reqs_repo_name,
-                           input_requirements_file_path):
-    wheel_to_extras = _make_wheel_to_extras(wheels)
-
-    join_str = ',\n    '
-    pypi_name_to_py_library = join_str.join([
-        join_str.join([
-            '"{pypi_name}": "@{wheel_name}//:pkg"'.format(
-                pypi_name=wheel.distribution().lower(),
-                wheel_name=_make_wheel_name(reqs_repo_name, wheel))
-        ] + [
-            # For every extra that is possible from this requirements.txt
-            '"{pypi_name}[{extra}]": "@{wheel_name}//:{extra}"'.format(
-                pypi_name=wheel.distribution().lower(),
-                extra=extra.lower(),
-                wheel_name=_make_wheel_name(reqs_repo_name, wheel))
-            for extra in wheel_to_extras.get(wheel, [])
-        ]) for wheel in wheels
-    ])
+def _make_bzl_file_content(wheels,
+                           reqs_repo_name,
+                           input_requirements_file_path,
+                           tracer=None,
+                           dedupe_native=False):
+    parts = []
+    _write_bzl_file(
+        parts.append,
+        wheels=wheels,
+        reqs_repo_name=reqs_repo_name,
+        input_requirements_file_path=input_requirements_file_path,
+        tracer=tracer,
+        dedupe_native=dedupe_native)
+    return ''.join(parts)
 
-    pypi_name_to_whl_filegroup = join_str.join([
-        join_str.join([
-            '"{pypi_name}": "@{wheel_name}//:whl"'.format(
-                pypi_name=wheel.distribution().lower(),
-                wheel_name=_make_wheel_name(reqs_repo_name, wheel))
-        ] + [
-            # For every extra that is possible from this requirements.txt
-            '"{pypi_name}[{extra}]": "@{wheel_name}//:{extra}_whl"'.format(
-                pypi_name=wheel.distribution().lower(),
-                extra=extra.lower(),
-                wheel_name=_make_wheel_name(reqs_repo_name, wheel))
-            for extra in wheel_to_extras.get(wheel, [])
-        ]) for wheel in wheels
-    ])
 
-    merged_whl_repo_name = "{reqs_repo_name}_merged".format(
-        reqs_repo_name=reqs_repo_name)
-    merged_py_library = '"@{merged_whl_repo_name}//:pkg"'.format(
-        merged_whl_repo_name=merged_whl_repo_name)
-    merged_whl_filegroup = '"@{merged_whl_repo_name}//:whl"'.format(
-        merged_whl_repo_name=merged_whl_repo_name)
+def _write_bzl_file(write,
+                    wheels,
+                    reqs_repo_name,
+                    input_requirements_file_path,
+                    tracer=None,
+                    dedupe_native=False,
+                    wheel_to_extras=None):
+    """Writes the requirements.bzl for wheels, one section at a time.
 
-    if wheels:
-        whl_library_rule_list = []
-        for wheel in wheels:
-            extras = ','.join(
-                ['"%s"' % extra for extra in wheel_to_extras.get(wheel, [])])
-            whl_library_rule = _make_whl_library_rule(
+    The names derived from each wheel are computed once, and every section is
+    passed to write as soon as it is formatted, so time and memory stay linear
+    in the number of wheels and extras.
+
+    Args:
+      write: a callable taking each successive chunk of the file.
+      wheels: a list of Wheel objects.
+      reqs_repo_name: the name of the pip_import repository.
+      input_requirements_file_path: the requirements.txt being imported.
+      tracer: a Tracer for the extras resolution.
+      dedupe_native: whether the whl_library rules should dedupe native
+        libraries.
+      wheel_to_extras: the result of _make_wheel_to_extras(wheels), if it
+        has already been computed.
+    """
+    tracer = tracer or Tracer()
+    if wheel_to_extras is None:
+        with tracer.span('extras_resolution', wheels=len(wheels)):
+            wheel_to_extras = _make_wheel_to_extras(wheels, tracer)
+
+    entries = [(wheel, normalize_name(wheel.distribution()),
+                _make_wheel_name(reqs_repo_name, wheel),
+                wheel_to_extras.get(wheel, [])) for wheel in wheels]
+
+    write(
+        _BZL_HEADER.format(
+            input=input_requirements_file_path, whl_library=_WHL_LIBRARY_RULE))
+    if not entries:
+        write('pass')
+    for index, (wheel, _, wheel_name, extras) in enumerate(entries):
+        if index:
+            write('\n')
+        write(
+            _make_whl_library_rule(
                 reqs_repo_name=reqs_repo_name,
-                whl_repo_name=_make_wheel_name(reqs_repo_name, wheel),
+                whl_repo_name=wheel_name,
                 wheels=[wheel],
-                extras=extras)
-            whl_library_rule_list.append(whl_library_rule)
-        whl_library_rules = '\n'.join(whl_library_rule_list)
-
-        merged_whl_library_rule = _make_whl_library_rule(
-            reqs_repo_name=reqs_repo_name,
-            whl_repo_name=merged_whl_repo_name,
-            wheels=wheels,
-            extras='')
-    else:
-        whl_library_rules = 'pass'
-
-    return _populate_bzl_template(
-        input_requirements_file_path=input_requirements_file_path,
-        whl_library_rules=whl_library_rules,
-        pypi_name_to_py_library=pypi_name_to_py_library,
-        pypi_name_to_whl_filegroup=pypi_name_to_whl_filegroup,
-        merged_whl_library_rule=merged_whl_library_rule,
-        merged_py_library=merged_py_library,
-        merged_whl_filegroup=merged_whl_filegroup)
-
-
-def _make_wheel_to_extras(wheels):
+                extras=','.join(['"%s"' % extra for extra in extras]),
+                trace=tracer.enabled(),
+                dedupe_native=dedupe_native))
+
+    write('\n\n_requirements = {\n    ')
+    # For every extra that is possible from this requirements.txt, there is
+    # also a "name[extra]" entry.
+    _write_requirement_entries(write, entries, '//:pkg', '//:{extra}')
+    write('\n}\n\n_whl_requirements = {\n    ')
+    _write_requirement_entries(write, entries, '//:whl', '//:{extra}_whl')
+    write('\n}\n\n')
+
+    write(_BZL_FOOTER.format(reqs_repo_name=reqs_repo_name))
+
+
+def _write_requirement_entries(write, entries, target, extra_target):
+    separator = ''
+    for _, pypi_name, wheel_name, extras in entries:
+        write('{}"{}": "@{}{}"'.format(separator, pypi_name, wheel_name,
+                                       target))
+        separator = ',\n    '
+        for extra in extras:
+            # The key is looked up by _make_name_key, which normalizes the
+            # extra along with the name, while the whl_library names the
+            # target after the extra as its wheel declares it.
+            write('{}"{}[{}]": "@{}{}"'.format(
+                separator, pypi_name, normalize_name(extra), wheel_name,
+                extra_target.format(extra=extra)))
+
+
+def _make_wheel_to_extras(wheels, tracer=None):
     """Determines the list of possible "extras" for each .whl file.
 
     The possibility of an extra is determined by looking at its
@@ -211,17 +523,22 @@ def _make_wheel_to_extras(wheels):
 
     Args:
         wheels: a list of Wheel objects
+        tracer: a Tracer for the metadata reads of each wheel.
 
     Returns:
         a dict that is keyed by the Wheel objects in wheels, and whose
         values are lists of possible extras.
     """
-    pypi_name_to_wheel = {wheel.distribution(): wheel for wheel in wheels}
+    tracer = tracer or Tracer()
+    pypi_name_to_wheel = {
+        normalize_name(wheel.distribution()): wheel
+        for wheel in wheels
+    }
 
     # TODO(mattmoor): Consider memoizing if this recursion ever becomes
     # expensive enough to warrant it.
     def is_possible(pypi_name, extra):
-        pypi_name = pypi_name.replace("-", "_")
+        pypi_name = normalize_name(pypi_name)
         # If we don't have the .whl at all, then this isn't possible.
         if pypi_name not in pypi_name_to_wheel:
             return False
@@ -244,13 +561,17 @@ def _make_wheel_to_extras(wheels):
         # it is possible to construct this dependency.
         return True
 
-    return {
-        wheel: [
-            extra for extra in wheel.extras()
-            if is_possible(wheel.distribution(), extra)
-        ]
-        for wheel in wheels
-    }
+    wheel_to_extras = {}
+    for wheel in wheels:
+        with tracer.span(
+                wheel.basename(),
+                category='extras',
+                bytes=os.path.getsize(wheel.path())):
+            wheel_to_extras[wheel] = [
+                extra for extra in wheel.extras()
+                if is_possible(wheel.distribution(), extra)
+            ]
+    return wheel_to_extras
 
 
 _WHL_LIBRARY_RULE_TEMPLATE = """
@@ -259,15 +580,25 @@ _WHL_LIBRARY_RULE_TEMPLATE = """
         name = "{whl_repo_name}",
         whls = [{whls}],
         requirements = "@{reqs_repo_name}//:requirements.bzl",
-        extras = [{extras}]
+        extras = [{extras}],{options}
     )"""
 
 
-def _make_whl_library_rule(reqs_repo_name, whl_repo_name, wheels, extras):
+def _make_whl_library_rule(reqs_repo_name,
+                           whl_repo_name,
+                           wheels,
+                           extras,
+                           trace=False,
+                           dedupe_native=False):
     whls = ', '.join([
         '"@{name}//:{path}"'.format(
             name=reqs_repo_name, path=wheel.basename()) for wheel in wheels
     ])
+    options = ''
+    if trace:
+        options += '\n        trace = True,'
+    if dedupe_native:
+        options += '\n        dedupe_native = True,'
     # Indentation here matters.  whl_library must be within the scope
     # of the function below.  We also avoid reimporting an existing WHL.
     return _WHL_LIBRARY_RULE_TEMPLATE.format(
@@ -275,10 +606,12 @@ def _make_whl_library_rule(reqs_repo_name, whl_repo_name, wheels, extras):
         reqs_repo_name=reqs_repo_name,
         extras=extras,
         whl_library=_WHL_LIBRARY_RULE,
-        whls=whls)
+        whls=whls,
+        options=options)
 
 
-_BZL_TEMPLATE = textwrap.dedent("""\
+# The rules of pip_install() follow the header.
+_BZL_HEADER = textwrap.dedent("""\
     # Install pip requirements.
     #
     # Generated from {input}
@@ -286,25 +619,22 @@ _BZL_TEMPLATE = textwrap.dedent("""\
     load("@io_bazel_rules_python//python:whl.bzl", "{whl_library}")
 
     def pip_install():
-        {whl_library_rules}
-        {merged_whl_library_rule}
-
-    _requirements = {{
-        {pypi_name_to_py_library}
-    }}
-
-    _whl_requirements = {{
-        {pypi_name_to_whl_filegroup}
-    }}
-
-    _merged_py_library = {merged_py_library}
-    _merged_whl_filegroup = {merged_whl_filegroup}
+""") + '    '
 
+# The footer follows the _requirements and _whl_requirements dicts.
+_BZL_FOOTER = textwrap.dedent("""\
     def pypi_requirements():
-        return _merged_py_library
+        return "@{reqs_repo_name}//:pypi_requirements"
 
     def pypi_whl_requirements():
-        return _merged_whl_filegroup
+        return "@{reqs_repo_name}//:pypi_whl_requirements"
+
+    def pypi_requirement(name):
+        # The requirement along with everything it depends on, transitively.
+        name_key = _make_name_key(name)
+        if name_key not in _requirements:
+            fail("Could not find pip-provided dependency: '%s'; available: %s" % (name, sorted(_requirements.keys())))
+        return "@{reqs_repo_name}//:" + name_key
 
     def pypi_whl_requirement(name):
         name_key = _make_name_key(name)
@@ -319,25 +649,245 @@ _BZL_TEMPLATE = textwrap.dedent("""\
             fail("Could not find pip-provided dependency: '%s'; available: %s" % (name, sorted(_requirements.keys())))
         return _requirements[name_key]
 
+    def entry_point(name, script = None):
+        # The py_binary launcher for one of the package's console_scripts.
+        if not script:
+            script = name
+        repo = requirement(name).split("//")[0]
+        return repo + "//console_scripts:" + script
+
     def _make_name_key(name):
-        name_key = name.replace("-", "_").lower()
-        return name_key
+        # Matches normalize_name in whl.py, after
+        # https://www.python.org/dev/peps/pep-0503/#normalized-names
+        name_key = name.lower().replace("_", "-").replace(".", "-")
+        return "-".join([part for part in name_key.split("-") if part])
 """)
 
 
-def _populate_bzl_template(input_requirements_file_path, whl_library_rules,
-                           pypi_name_to_py_library, pypi_name_to_whl_filegroup,
-                           merged_whl_library_rule, merged_py_library,
-                           merged_whl_filegroup):
-    return _BZL_TEMPLATE.format(
-        input=input_requirements_file_path,
-        whl_library_rules=whl_library_rules,
-        pypi_name_to_py_library=pypi_name_to_py_library,
-        pypi_name_to_whl_filegroup=pypi_name_to_whl_filegroup,
-        whl_library=_WHL_LIBRARY_RULE,
-        merged_whl_library_rule=merged_whl_library_rule,
-        merged_py_library=merged_py_library,
-        merged_whl_filegroup=merged_whl_filegroup)
+_BUILD_HEADER = textwrap.dedent("""\
+    package(default_visibility = ["//visibility:public"])
+
+    # Generated from {input}
+    #
+    # Each requirement is a py_library of its wheel and of the requirements
+    # it depends on, and so of their wheels, transitively.  Building against
+    # one of them fetches and extracts only the whl_library repositories of
+    # those wheels.  Requirements that depend on each other share one
+    # _cycle_ py_library of all their wheels, since Bazel forbids cycles.
+
+""")
+
+_CLOSURE_TEMPLATE = textwrap.dedent("""\
+    py_library(
+        name = "{name}",
+        deps = [{deps}
+        ],
+    )
+
+""")
+
+# The .whl files are in this repository, so the aggregate filegroup needs
+# none of the whl_library repositories.
+_BUILD_FOOTER = textwrap.dedent("""\
+    filegroup(
+        name = "pypi_whl_requirements",
+        srcs = [{whls}
+        ],
+    )
+""")
+
+
+def _write_build_file(write, wheels, reqs_repo_name,
+                      input_requirements_file_path, wheel_to_extras):
+    """Writes the BUILD file of the pip_import repository.
+
+    Each (wheel, extra) requirement lists only the requirements it depends
+    on directly, so the file grows with the number of dependencies rather
+    than with the size of every requirement's closure.
+
+    Args:
+      write: a callable taking each successive chunk of the file.
+      wheels: a list of Wheel objects.
+      reqs_repo_name: the name of the pip_import repository.
+      input_requirements_file_path: the requirements.txt being imported.
+      wheel_to_extras: the result of _make_wheel_to_extras(wheels).
+    """
+    requirements_of = _make_requirement_graph(wheels)
+    order = {wheel: index for index, wheel in enumerate(wheels)}
+    nodes = []
+    for wheel in wheels:
+        nodes.append((wheel, None))
+        nodes.extend(
+            [(wheel, extra) for extra in wheel_to_extras.get(wheel, [])])
+    components = _strongly_connected_components(nodes, requirements_of)
+    component_of = {
+        node: component
+        for component in components for node in component
+    }
+
+    def sort_key(node):
+        return order[node[0]], node[1] or ''
+
+    def pkg_label(wheel):
+        return '"@{}//:pkg"'.format(_make_wheel_name(reqs_repo_name, wheel))
+
+    def deps(labels):
+        return ''.join(['\n        {},'.format(label) for label in labels])
+
+    write(_BUILD_HEADER.format(input=input_requirements_file_path))
+    # Requirements are written in the order of wheels, each followed by the
+    # extras that it or others require.
+    for node in sorted(component_of, key=sort_key):
+        component = component_of[node]
+        if len(component) == 1:
+            labels = [pkg_label(node[0])] if node[1] is None else []
+            labels.extend([
+                '":{}"'.format(_target_name(requirement))
+                for requirement in sorted(
+                    set(requirements_of(node)) - set([node]), key=sort_key)
+            ])
+            write(_CLOSURE_TEMPLATE.format(
+                name=_target_name(node), deps=deps(labels)))
+            continue
+
+        members = sorted(component, key=sort_key)
+        cycle = '_cycle_' + _target_name(members[0])
+        if node == members[0]:
+            labels = [
+                pkg_label(wheel)
+                for wheel in sorted(
+                    set([wheel for wheel, _ in members]), key=order.get)
+            ]
+            outside = set()
+            for member in members:
+                outside.update(requirements_of(member))
+            labels.extend([
+                '":{}"'.format(_target_name(requirement))
+                for requirement in sorted(
+                    outside - set(members), key=sort_key)
+            ])
+            write(_CLOSURE_TEMPLATE.format(name=cycle, deps=deps(labels)))
+        write(_CLOSURE_TEMPLATE.format(
+            name=_target_name(node), deps=deps(['":{}"'.format(cycle)])))
+    write(
+        _CLOSURE_TEMPLATE.format(
+            name='pypi_requirements',
+            deps=deps([pkg_label(wheel) for wheel in wheels])))
+    write(
+        _BUILD_FOOTER.format(whls=''.join([
+            '\n        "{}",'.format(wheel.basename()) for wheel in wheels
+        ])))
+
+
+def _target_name(node):
+    # The key that requirements.bzl looks the requirement up by.
+    wheel, extra = node
+    name = normalize_name(wheel.distribution())
+    if extra is None:
+        return name
+    return '{}[{}]'.format(name, normalize_name(extra))
+
+
+def _make_requirement_graph(wheels):
+    """Returns a function listing what a requirement directly depends on.
+
+    A requirement is a (wheel, extra) pair of one of wheels, with an extra
+    of None for the wheel alone.  The function takes one and returns the
+    requirements it needs at runtime, besides itself: the wheel alone for
+    an extra, and the wheels of its Requires-Dist, along with the extras
+    they declare and are required with.  Dependencies that none of wheels
+    provides (e.g. because pip skipped them for their environment markers)
+    are ignored.
+
+    Args:
+        wheels: a list of Wheel objects
+    """
+    name_key_to_wheel = {
+        normalize_name(wheel.distribution()): wheel
+        for wheel in wheels
+    }
+    # The requirements of each requirement, which are read from the wheels'
+    # metadata only once.
+    edges = {}
+
+    def requirements_of(node):
+        if node not in edges:
+            wheel, extra = node
+            requirements = [] if extra is None else [(wheel, None)]
+            for dependency in wheel.dependencies(extra=extra):
+                req = pkg_resources.Requirement.parse(dependency)
+                dependency_wheel = name_key_to_wheel.get(
+                    normalize_name(req.project_name))
+                if dependency_wheel is None:
+                    continue
+                requirements.append((dependency_wheel, None))
+                # pkg_resources spells extras its own way, so match them
+                # with those the wheel declares by their normalized names.
+                declared = {
+                    normalize_name(extra_): extra_
+                    for extra_ in dependency_wheel.extras()
+                }
+                for extra_ in req.extras:
+                    if normalize_name(extra_) in declared:
+                        requirements.append(
+                            (dependency_wheel,
+                             declared[normalize_name(extra_)]))
+            edges[node] = requirements
+        return edges[node]
+
+    return requirements_of
+
+
+def _strongly_connected_components(roots, successors):
+    """Finds the strongly connected components of a graph, per Tarjan.
+
+    Args:
+      roots: the nodes from which to explore the graph.
+      successors: a function returning the nodes that a node points to.
+
+    Returns:
+      a list of the components reachable from roots, each a list of nodes.
+    """
+    index = {}
+    lowlink = {}
+    stack = []
+    on_stack = set()
+    components = []
+    for root in roots:
+        if root in index:
+            continue
+        # An explicit stack of (node, iterator over its successors), since
+        # dependency chains can be deeper than Python's recursion limit.
+        work = [(root, iter(successors(root)))]
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while work:
+            node, children = work[-1]
+            for child in children:
+                if child not in index:
+                    index[child] = lowlink[child] = len(index)
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors(child))))
+                    break
+                if child in on_stack:
+                    lowlink[node] = min(lowlink[node], index[child])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[node])
+                if lowlink[node] == index[node]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.remove(member)
+                        component.append(member)
+                        if member == node:
+                            break
+                    components.append(component)
+    return components
 
 
 def _make_wheel_name(namespace, wheel):
@@ -0,0 +1,322 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import types
+import unittest
+
+from mock import patch
+
+from rules_python import piptool
+from rules_python import testutil
+from rules_python.tracing import Tracer
+from rules_python import whl
+
+
+class PipToolTest(testutil.WheelTestCase):
+    def make_wheel(self, basename, requires_dist=(), files=None):
+        headers = []
+        for requirement in requires_dist:
+            if 'extra ==' in requirement:
+                headers.append('Provides-Extra: {}'.format(
+                    requirement.split('"')[-2]))
+            headers.append('Requires-Dist: {}'.format(requirement))
+        return super(PipToolTest, self).make_wheel(
+            basename, headers, files=files)
+
+    def test_closure(self):
+        app = self.make_wheel(
+            'app-1.0-py2.py3-none-any.whl',
+            ['Lib~=1.0', 'fast!=0.9; extra == "speedups"', 'missing'])
+        lib = self.make_wheel('Lib-1.0-py2.py3-none-any.whl', ['app'])
+        fast = self.make_wheel('fast-1.0-py2.py3-none-any.whl')
+        other = self.make_wheel('other-1.0-py2.py3-none-any.whl')
+        wheels = [app, lib, fast, other]
+
+        parts = []
+        piptool._write_build_file(
+            parts.append,
+            wheels=wheels,
+            reqs_repo_name='deps',
+            input_requirements_file_path='requirements.txt',
+            wheel_to_extras=piptool._make_wheel_to_extras(wheels))
+        content = ''.join(parts)
+        app_pkg = '@deps_pypi__app_1_0//:pkg'
+        lib_pkg = '@deps_pypi__Lib_1_0//:pkg'
+        fast_pkg = '@deps_pypi__fast_1_0//:pkg'
+        self.assertEqual(set([app_pkg, lib_pkg]), _closure(content, 'app'))
+        self.assertEqual(
+            set([app_pkg, lib_pkg, fast_pkg]),
+            _closure(content, 'app[speedups]'))
+        self.assertEqual(set([app_pkg, lib_pkg]), _closure(content, 'lib'))
+        self.assertEqual(
+            set(['@deps_pypi__other_1_0//:pkg']), _closure(content, 'other'))
+
+        # Each requirement lists only its direct dependencies, and app and
+        # Lib, which require each other, share one target.
+        self.assertIn(
+            'name = "app[speedups]",\n    deps = [\n'
+            '        ":app",\n'
+            '        ":fast",\n    ],', content)
+        self.assertIn(
+            'name = "_cycle_app",\n    deps = [\n'
+            '        "@deps_pypi__app_1_0//:pkg",\n'
+            '        "@deps_pypi__Lib_1_0//:pkg",\n    ],', content)
+        self.assertIn('"other-1.0-py2.py3-none-any.whl",', content)
+        # Target names are the normalized names that requirements.bzl
+        # looks up.
+        self.assertIn('name = "lib",\n    deps = [\n        ":_cycle_app",',
+                      content)
+
+    def test_deep_chain(self):
+        # Deeper than Python's recursion limit.
+        count = sys.getrecursionlimit() + 10
+        wheels = [
+            self.make_wheel('w{}-1.0-py2.py3-none-any.whl'.format(index),
+                            ['w{}'.format(index + 1)] if index + 1 < count
+                            else [])
+            for index in range(count)
+        ]
+        parts = []
+        piptool._write_build_file(
+            parts.append,
+            wheels=wheels,
+            reqs_repo_name='deps',
+            input_requirements_file_path='requirements.txt',
+            wheel_to_extras={})
+        content = ''.join(parts)
+        self.assertIn(
+            'name = "w0",\n    deps = [\n'
+            '        "@deps_pypi__w0_1_0//:pkg",\n'
+            '        ":w1",\n    ],', content)
+        self.assertNotIn('name = "_cycle_', content)
+
+    def test_extra_names(self):
+        wheel = self.make_wheel('foo_bar-1.0-py2.py3-none-any.whl',
+                                ['six; extra == "with_six"'])
+        six = self.make_wheel('six-1.11.0-py2.py3-none-any.whl')
+        wheels = [wheel, six]
+        wheel_to_extras = piptool._make_wheel_to_extras(wheels)
+        self.assertEqual(['with_six'], wheel_to_extras[wheel])
+
+        # Run the Starlark that requirements.bzl looks names up with.
+        starlark = {}
+        exec(
+            piptool._BZL_FOOTER[piptool._BZL_FOOTER.index(
+                'def _make_name_key'):], starlark)
+        name_key = starlark['_make_name_key']('Foo_Bar[With_Six]')
+        self.assertEqual(name_key, starlark['_make_name_key'](name_key))
+
+        content = piptool._make_bzl_file_content(
+            wheels=wheels,
+            reqs_repo_name='deps',
+            input_requirements_file_path='requirements.txt')
+        self.assertIn(
+            '"{}": "@deps_pypi__foo_bar_1_0//:with_six"'.format(name_key),
+            content)
+        self.assertIn(
+            '"{}": "@deps_pypi__foo_bar_1_0//:with_six_whl"'.format(name_key),
+            content)
+        parts = []
+        piptool._write_build_file(
+            parts.append,
+            wheels=wheels,
+            reqs_repo_name='deps',
+            input_requirements_file_path='requirements.txt',
+            wheel_to_extras=wheel_to_extras)
+        self.assertIn('name = "{}",'.format(name_key), ''.join(parts))
+
+    def test_console_script_closure(self):
+        tool = self.make_wheel(
+            'tool-1.0-py2.py3-none-any.whl', ['helper'],
+            files={
+                'tool/__init__.py':
+                '',
+                'tool/cli.py':
+                'import helper\n'
+                '\n'
+                'def main():\n'
+                '    print(helper.NAME)\n',
+                'tool-1.0.dist-info/entry_points.txt':
+                '[console_scripts]\ntool = tool.cli:main\n',
+            })
+        helper = self.make_wheel(
+            'helper-1.0-py2.py3-none-any.whl',
+            files={'helper/__init__.py': 'NAME = "helper"\n'})
+        wheels = [tool, helper]
+        repositories = {}
+        for wheel in wheels:
+            name = piptool._make_wheel_name('deps', wheel)
+            repositories[name] = os.path.join(self.tmpdir, name)
+            wheel.expand(repositories[name])
+
+        tool_repository = repositories['deps_pypi__tool_1_0']
+        whl._write_console_scripts(tool_repository,
+                                   {'tool': ('tool', 'tool.cli:main')},
+                                   '@deps//:requirements.bzl')
+        with open(os.path.join(tool_repository, 'console_scripts',
+                               'BUILD')) as file_obj:
+            build = file_obj.read()
+        self.assertIn(
+            'load("@deps//:requirements.bzl", "pypi_requirement")', build)
+        self.assertIn('deps = [pypi_requirement("tool")],', build)
+
+        # pypi_requirement("tool") is the "tool" target of the pip_import
+        # repository; run the launcher with the repositories it depends on.
+        parts = []
+        piptool._write_build_file(
+            parts.append,
+            wheels=wheels,
+            reqs_repo_name='deps',
+            input_requirements_file_path='requirements.txt',
+            wheel_to_extras={})
+        env = dict(
+            os.environ,
+            PYTHONPATH=os.pathsep.join([
+                repositories[label[1:-len('//:pkg')]]
+                for label in _closure(''.join(parts), 'tool')
+            ]))
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                os.path.join(tool_repository, 'console_scripts',
+                             '_launch_tool.py')
+            ],
+            stdout=subprocess.PIPE,
+            env=env)
+        stdout, _ = process.communicate()
+        self.assertEqual(0, process.returncode)
+        self.assertEqual('helper', stdout.decode('utf-8').strip())
+
+    def test_cache_wheels(self):
+        wheel = self.make_wheel('six-1.11.0-py2.py3-none-any.whl')
+        cache = os.path.join(self.tmpdir, 'cache')
+        tracer = Tracer(os.path.join(self.tmpdir, 'trace.json'))
+        linked = []
+        for name in ['py2_deps', 'py3_deps']:
+            directory = os.path.join(self.tmpdir, name)
+            staging = os.path.join(directory, 'staging')
+            os.makedirs(staging)
+            shutil.copy(wheel.path(), staging)
+            linked.extend(
+                piptool._cache_wheels(cache, [
+                    whl.Wheel(os.path.join(staging, wheel.basename()))
+                ], directory, tracer))
+
+        self.assertEqual(
+            [os.path.join(self.tmpdir, name, wheel.basename())
+             for name in ['py2_deps', 'py3_deps']],
+            [linked_wheel.path() for linked_wheel in linked])
+        self.assertTrue(os.path.samefile(linked[0].path(), linked[1].path()))
+        self.assertEqual(1, len(os.listdir(os.path.join(cache, 'sha256'))))
+        self.assertEqual([wheel.basename()],
+                         os.listdir(os.path.join(cache, 'wheels')))
+
+        tracer.write()
+        with open(os.path.join(self.tmpdir, 'trace.json')) as file_obj:
+            events = json.load(file_obj)['traceEvents']
+        self.assertEqual(
+            [(wheel.basename(), 'cache', os.path.getsize(wheel.path()))] * 2,
+            [(event['name'], event['cat'], event['args']['bytes'])
+             for event in events])
+
+    def test_extras_spans(self):
+        app = self.make_wheel('app-1.0-py2.py3-none-any.whl',
+                              ['six; extra == "six"'])
+        six = self.make_wheel('six-1.11.0-py2.py3-none-any.whl')
+        tracer = Tracer(os.path.join(self.tmpdir, 'trace.json'))
+        piptool._make_wheel_to_extras([app, six], tracer)
+
+        tracer.write()
+        with open(os.path.join(self.tmpdir, 'trace.json')) as file_obj:
+            events = json.load(file_obj)['traceEvents']
+        self.assertEqual(
+            [(wheel.basename(), 'extras', os.path.getsize(wheel.path()))
+             for wheel in [app, six]],
+            [(event['name'], event['cat'], event['args']['bytes'])
+             for event in events])
+
+    def test_pip_progress(self):
+        tracer = Tracer(os.path.join(self.tmpdir, 'trace.json'))
+        progress = piptool._PipProgress(tracer)
+        logger = logging.getLogger('pip.test')
+        logger.setLevel(logging.INFO)
+        logger.addHandler(progress)
+        self.addCleanup(logger.removeHandler, progress)
+        logger.info('Collecting six (from -r requirements.txt (line 1))')
+        logger.info('  Downloading six-1.11.0-py2.py3-none-any.whl')
+        logger.info('Collecting mock')
+        logger.info('Running setup.py bdist_wheel for mock: started')
+        progress.finish()
+
+        tracer.write()
+        with open(os.path.join(self.tmpdir, 'trace.json')) as file_obj:
+            events = json.load(file_obj)['traceEvents']
+        self.assertEqual([
+            'Collecting six (from -r requirements.txt (line 1))',
+            'Collecting mock',
+            'Running setup.py bdist_wheel for mock: started',
+        ], [event['name'] for event in events])
+        self.assertEqual(set(['pip']), set(event['cat'] for event in events))
+
+    def test_supported_tags(self):
+        tags = piptool._supported_tags()
+        self.assertTrue(tags)
+        self.assertTrue(all(isinstance(tag, tuple) for tag in tags))
+
+        # pip 10 to 19 keep the module of pip 9 under pip._internal.
+        pep425tags = types.ModuleType('pep425tags')
+        pep425tags.get_supported = lambda: [('cp36', 'cp36m', 'linux_x86_64')]
+        with patch.dict(sys.modules, {
+                'pip.pep425tags': None,
+                'pip._internal.pep425tags': pep425tags,
+        }):
+            self.assertEqual([('cp36', 'cp36m', 'linux_x86_64')],
+                             piptool._supported_tags())
+
+    def test_empty_bzl_file(self):
+        content = piptool._make_bzl_file_content(
+            wheels=[],
+            reqs_repo_name='deps',
+            input_requirements_file_path='requirements.txt')
+        self.assertIn('def pip_install():\n    pass\n', content)
+        self.assertNotIn('_merged', content)
+
+
+def _closure(build, name):
+    """Returns the :pkg labels that a py_library of build depends on."""
+    rules = dict(
+        re.findall(r'name = "([^"]*)",\n    deps = \[(.*?)\n    \],', build,
+                   re.DOTALL))
+    labels = set()
+    seen = set([name])
+    stack = [name]
+    while stack:
+        for label in re.findall(r'"([^"]*)"', rules[stack.pop()]):
+            if not label.startswith(':'):
+                labels.add(label)
+            elif label[1:] not in seen:
+                seen.add(label[1:])
+                stack.append(label[1:])
+    return labels
+
+
+if __name__ == '__main__':
+    unittest.main()
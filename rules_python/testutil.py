@@ -0,0 +1,59 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Helpers shared by the tests of piptool and whltool."""
+
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from rules_python import whl
+
+
+class WheelTestCase(unittest.TestCase):
+    """A TestCase with a temporary directory in which to make wheels."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def make_wheel(self, basename, headers=None, description='', files=None):
+        """Writes a .whl file into tmpdir.
+
+        Args:
+          basename: the filename of the wheel.
+          headers: the lines of its METADATA headers besides Name, e.g.
+            "Requires-Dist: six"; if None, it has no METADATA file.
+          description: the text following the METADATA headers.
+          files: a dict from the names of the other files in the wheel to
+            their content.
+
+        Returns:
+          the Wheel of the file.
+        """
+        path = os.path.join(self.tmpdir, basename)
+        parsed = whl.parse_filename(basename)
+        with zipfile.ZipFile(path, 'w') as whl_file:
+            if headers is not None:
+                whl_file.writestr(
+                    '{}-{}.dist-info/METADATA'.format(
+                        parsed['distribution'], parsed['version']),
+                    'Name: {}\n{}\n{}'.format(
+                        parsed['distribution'],
+                        ''.join([header + '\n' for header in headers]),
+                        description))
+            for name, content in sorted((files or {}).items()):
+                whl_file.writestr(name, content)
+        return whl.Wheel(path)
@@ -0,0 +1,80 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The tracing module records timed spans as Chrome trace-event JSON.
+
+The output can be loaded in chrome://tracing or https://ui.perfetto.dev.
+See https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+for the format.
+"""
+
+import contextlib
+import json
+import os
+import time
+
+
+class Tracer(object):
+    """Collects complete ("X") trace events for a single process."""
+
+    def __init__(self, path=None):
+        self._path = path
+        self._pid = os.getpid()
+        self._events = []
+
+    def enabled(self):
+        return self._path is not None
+
+    @contextlib.contextmanager
+    def span(self, name, category='phase', **args):
+        """Times the enclosed block as a span.
+
+        Args:
+          name: the name of the span.
+          category: the trace-event category, e.g. "phase" or "wheel".
+          **args: initial arguments to attach to the span.
+
+        Yields:
+          a dict of arguments, to which the block may add entries (e.g.
+          byte counts) that are only known once it has run.
+        """
+        start = time.time()
+        try:
+            yield args
+        finally:
+            self.add_span(name, start, time.time(), category, **args)
+
+    def add_span(self, name, start, end, category='phase', **args):
+        """Records a span from start to end, given in seconds since epoch."""
+        if not self.enabled():
+            return
+        self._events.append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': int(start * 1e6),
+            'dur': int((end - start) * 1e6),
+            'pid': self._pid,
+            'tid': 0,
+            'args': args,
+        })
+
+    def write(self):
+        """Writes the collected events to the trace file, if enabled."""
+        if not self.enabled():
+            return
+        with open(self._path, 'w') as file_obj:
+            json.dump({
+                'traceEvents': self._events,
+                'displayTimeUnit': 'ms',
+            }, file_obj)
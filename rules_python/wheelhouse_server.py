@@ -0,0 +1,326 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Serves a directory of .whl files as a PEP 503 simple package index.
+
+This lets many concurrent pip_import fetches share one local wheelhouse:
+
+  bazel run //rules_python:wheelhouse_server -- \\
+      --directory /srv/wheelhouse --port 8080
+
+and then pip_import(..., index_url = "http://localhost:8080/simple/").
+It listens only on localhost unless given --host (e.g. 0.0.0.0); pip then
+needs the server's host passed as the trusted_host of the pip_import, since
+it is plain HTTP.
+
+The server speaks HTTP/1.1, so pip reuses its pooled connections across
+requests, supports single byte-range requests, and caches each rendered
+index page until the files it lists change.
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import threading
+
+try:
+    # pylint: disable=F0401
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import quote, unquote
+except ImportError:
+    # pylint: disable=F0401
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import quote, unquote
+
+from rules_python.whl import normalize_name
+
+_ARCHIVE_SUFFIXES = ('.whl', '.tar.gz', '.tar.bz2', '.zip')
+
+_RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def project_name(filename):
+    """Returns the project name of a distribution filename, or None."""
+    if filename.endswith('.whl'):
+        # See https://www.python.org/dev/peps/pep-0427/#file-name-convention
+        return filename.split('-')[0]
+    for suffix in _ARCHIVE_SUFFIXES:
+        if filename.endswith(suffix):
+            # sdists are named <name>-<version><suffix>.
+            return filename[:-len(suffix)].rsplit('-', 1)[0]
+    return None
+
+
+class Wheelhouse(object):
+    """Renders and caches the index pages of a directory of distributions.
+
+    Each project's page is rendered, and the sha256 of its files computed,
+    only when it is first requested, outside of the lock, so that one slow
+    page does not hold up the others.  A cached page is served only while
+    the mtime and size of each of its files are unchanged, since a file
+    overwritten in place leaves the mtime of the directory unchanged.
+    """
+
+    def __init__(self, directory):
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._projects = {}
+        self._pages = {}
+        self._digests = {}
+
+    def path(self, filename):
+        """Returns the path of filename, if it is served."""
+        if filename != os.path.basename(filename):
+            return None
+        if project_name(filename) is None:
+            return None
+        path = os.path.join(self._directory, filename)
+        return path if os.path.isfile(path) else None
+
+    def page(self, project=None):
+        """Returns the HTML of the root index, or of a project's page."""
+        with self._lock:
+            mtime = os.stat(self._directory).st_mtime
+            if mtime != self._mtime:
+                self._projects = self._list_projects()
+                self._pages = {}
+                self._mtime = mtime
+            projects = self._projects
+
+        if project is None:
+            files = ()
+        elif project in projects:
+            files = self._stat(projects[project])
+        else:
+            return None
+
+        with self._lock:
+            cached = self._pages.get(project)
+            if cached is not None and cached[0] == files:
+                return cached[1]
+
+        if project is None:
+            content = _page('Simple index', [('{}/'.format(name), name)
+                                             for name in sorted(projects)])
+        else:
+            content = _page('Links for {}'.format(project), [
+                ('../../files/{}#sha256={}'.format(
+                    quote(key[0]), self._sha256(key)), key[0])
+                for key in files
+            ])
+
+        with self._lock:
+            # Unless the directory changed in the meantime.
+            if self._projects is projects:
+                self._pages[project] = (files, content)
+        return content
+
+    def _list_projects(self):
+        projects = {}
+        for filename in sorted(os.listdir(self._directory)):
+            name = project_name(filename)
+            if name is not None:
+                projects.setdefault(normalize_name(name), []).append(filename)
+        return projects
+
+    def _stat(self, filenames):
+        # The (filename, mtime, size) of each file that still exists.
+        files = []
+        for filename in filenames:
+            try:
+                stat = os.stat(os.path.join(self._directory, filename))
+            except OSError:
+                continue
+            files.append((filename, stat.st_mtime, stat.st_size))
+        return tuple(files)
+
+    def _sha256(self, key):
+        if key not in self._digests:
+            digest = hashlib.sha256()
+            with open(os.path.join(self._directory, key[0]),
+                      'rb') as file_obj:
+                for chunk in iter(lambda: file_obj.read(1 << 20), b''):
+                    digest.update(chunk)
+            self._digests[key] = digest.hexdigest()
+        return self._digests[key]
+
+
+def _page(title, links):
+    anchors = '\n'.join('    <a href="{}">{}</a><br/>'.format(href, text)
+                        for href, text in links)
+    return ('<!DOCTYPE html>\n<html>\n  <head><title>{title}</title></head>\n'
+            '  <body>\n    <h1>{title}</h1>\n{anchors}\n  </body>\n</html>\n'
+            ).format(
+                title=title, anchors=anchors).encode('utf-8')
+
+
+def make_handler(wheelhouse):
+    """Returns a request handler class serving wheelhouse."""
+
+    class Handler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps connections alive between requests.
+        protocol_version = 'HTTP/1.1'
+
+        def do_HEAD(self):  # pylint: disable=C0103
+            self._serve(send_body=False)
+
+        def do_GET(self):  # pylint: disable=C0103
+            self._serve(send_body=True)
+
+        def _serve(self, send_body):
+            path = unquote(self.path.split('?', 1)[0].split('#', 1)[0])
+            parts = [part for part in path.split('/') if part]
+            if parts == ['simple']:
+                self._send_page(wheelhouse.page(), send_body)
+            elif len(parts) == 2 and parts[0] == 'simple':
+                self._send_page(
+                    wheelhouse.page(normalize_name(parts[1])), send_body)
+            elif len(parts) == 2 and parts[0] == 'files':
+                self._send_file(wheelhouse.path(parts[1]), send_body)
+            else:
+                self._send_error(404)
+
+        def _send_page(self, content, send_body):
+            if content is None:
+                self._send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(content)))
+            # The page changes as soon as a file is added or replaced.
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            if send_body:
+                self.wfile.write(content)
+
+        def _send_file(self, path, send_body):
+            if path is None:
+                self._send_error(404)
+                return
+            size = os.path.getsize(path)
+            start, end = 0, size - 1
+            status = 200
+            requested = self.headers.get('Range')
+            if requested:
+                byte_range = _parse_range(requested, size)
+                if byte_range is None:
+                    self.send_response(416)
+                    self.send_header('Content-Range',
+                                     'bytes */{}'.format(size))
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                start, end = byte_range
+                status = 206
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(end - start + 1))
+            self.send_header('Accept-Ranges', 'bytes')
+            if status == 206:
+                self.send_header('Content-Range', 'bytes {}-{}/{}'.format(
+                    start, end, size))
+            self.end_headers()
+            if not send_body:
+                return
+            with open(path, 'rb') as file_obj:
+                file_obj.seek(start)
+                _copy(file_obj, self.wfile, end - start + 1)
+
+        def _send_error(self, code):
+            self.send_response(code)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    return Handler
+
+
+def _parse_range(header, size):
+    """Parses a single byte range, returning inclusive (start, end) or None."""
+    match = _RANGE_PATTERN.match(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        # A suffix range: the last N bytes.
+        start = max(size - int(match.group(2)), 0)
+        end = size - 1
+    else:
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size - 1
+        end = min(end, size - 1)
+    if start > end:
+        return None
+    return start, end
+
+
+def _copy(src, dst, length):
+    while length > 0:
+        chunk = src.read(min(length, 1 << 16))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(directory, host='127.0.0.1', port=0):
+    """Returns an HTTP server for directory; port 0 picks a free port."""
+    return _ThreadingHTTPServer((host, port),
+                                make_handler(Wheelhouse(directory)))
+
+
+def main():
+    args = _parse_args()
+    server = make_server(args.directory, host=args.host, port=args.port)
+    print('Serving {} at http://{}:{}/simple/'.format(
+        args.directory, server.server_address[0], server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(
+        description='Serve a directory of .whl files as a package index.')
+    parser.add_argument(
+        '--directory',
+        action='store',
+        required=True,
+        help='The directory of .whl files to serve.')
+    parser.add_argument(
+        '--host',
+        action='store',
+        default='127.0.0.1',
+        help=('The address on which to listen; 0.0.0.0 serves other '
+              'hosts too.'))
+    parser.add_argument(
+        '--port',
+        action='store',
+        type=int,
+        default=8080,
+        help='The port on which to listen.')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# Copyright 2017 The Bazel Authors. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    from http.client import HTTPConnection  # pylint: disable=F0401
+except ImportError:
+    from httplib import HTTPConnection  # pylint: disable=F0401
+
+from rules_python import wheelhouse_server
+
+_WHEEL = 'Foo_Bar-1.0-py2.py3-none-any.whl'
+_CONTENT = b'0123456789' * 100
+
+
+class WheelhouseServerTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        with open(os.path.join(self.tmpdir, _WHEEL), 'wb') as file_obj:
+            file_obj.write(_CONTENT)
+        with open(os.path.join(self.tmpdir, 'README'), 'w') as file_obj:
+            file_obj.write('not a distribution')
+
+        server = wheelhouse_server.make_server(self.tmpdir)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        # A single connection is kept alive across all requests of a test.
+        self.connection = HTTPConnection(*server.server_address)
+        self.addCleanup(self.connection.close)
+
+    def get(self, path, headers=None):
+        self.connection.request('GET', path, headers=headers or {})
+        response = self.connection.getresponse()
+        return response.status, response.getheader('Content-Range'), (
+            response.read())
+
+    def test_index(self):
+        status, _, body = self.get('/simple/')
+        self.assertEqual(200, status)
+        self.assertIn(b'<a href="foo-bar/">foo-bar</a>', body)
+        self.assertNotIn(b'README', body)
+
+        status, _, body = self.get('/simple/Foo_Bar/')
+        self.assertEqual(200, status)
+        digest = hashlib.sha256(_CONTENT).hexdigest()
+        self.assertIn(
+            '../../files/{}#sha256={}'.format(_WHEEL, digest).encode('utf-8'),
+            body)
+
+        self.assertEqual(404, self.get('/simple/missing/')[0])
+        self.assertEqual(404, self.get('/files/README')[0])
+
+    def test_pages_are_rendered_lazily(self):
+        other = 'other-2.0-py3-none-any.whl'
+        with open(os.path.join(self.tmpdir, other), 'wb') as file_obj:
+            file_obj.write(b'other')
+        wheelhouse = wheelhouse_server.Wheelhouse(self.tmpdir)
+
+        self.assertIn(b'other/', wheelhouse.page())
+        self.assertEqual({}, wheelhouse._digests)
+        self.assertIn(other.encode('utf-8'), wheelhouse.page('other'))
+        self.assertEqual([other],
+                         [key[0] for key in wheelhouse._digests])
+
+    def test_overwritten_wheel(self):
+        path = os.path.join(self.tmpdir, _WHEEL)
+        directory_mtime = os.stat(self.tmpdir).st_mtime
+        self.assertIn(
+            hashlib.sha256(_CONTENT).hexdigest().encode('utf-8'),
+            self.get('/simple/foo-bar/')[2])
+
+        # Replace the wheel in place, which leaves the mtime of the
+        # directory as it was.
+        with open(path, 'wb') as file_obj:
+            file_obj.write(b'rebuilt')
+        os.utime(path, (directory_mtime + 10, directory_mtime + 10))
+        os.utime(self.tmpdir, (directory_mtime, directory_mtime))
+
+        self.connection.request('GET', '/simple/foo-bar/')
+        response = self.connection.getresponse()
+        self.assertEqual('no-cache', response.getheader('Cache-Control'))
+        self.assertIn(
+            hashlib.sha256(b'rebuilt').hexdigest().encode('utf-8'),
+            response.read())
+
+    def test_files(self):
+        self.assertEqual((200, None, _CONTENT),
+                         self.get('/files/{}'.format(_WHEEL)))
+        self.assertEqual((206, 'bytes 10-19/1000', _CONTENT[10:20]),
+                         self.get(
+                             '/files/{}'.format(_WHEEL),
+                             headers={'Range': 'bytes=10-19'}))
+        self.assertEqual((206, 'bytes 995-999/1000', _CONTENT[-5:]),
+                         self.get(
+                             '/files/{}'.format(_WHEEL),
+                             headers={'Range': 'bytes=-5'}))
+        self.assertEqual(416, self.get(
+            '/files/{}'.format(_WHEEL), headers={'Range': 'bytes=2000-'})[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,8 +14,11 @@
 """The whl modules defines classes for interacting with Python packages."""
 
 import argparse
+import errno
+import hashlib
 import json
 import os
+import platform
 import re
 import shutil
 import textwrap
@@ -23,15 +26,31 @@ import zipfile
 
 import pkg_resources
 
+from rules_python.tracing import Tracer
+
 
-# pylint: disable=R0914
 def main():
     args = _parse_args()
+    if args.inspect:
+        wheels = [Wheel(path) for path in args.whl_paths]
+        report = inspect_wheels(wheels, depth=args.inspect_depth)
+        print(json.dumps(report, indent=2, sort_keys=True))
+        return
+
+    tracer = Tracer(args.trace)
+    try:
+        _expand_wheels(args, tracer)
+    finally:
+        tracer.write()
 
+
+# pylint: disable=R0914
+def _expand_wheels(args, tracer):
     dependency_list = []
     whl_dependency_list = []
     extra_list = []
     whl_extra_list = []
+    console_scripts = {}
 
     whl_paths = args.whl_paths
     if args.whl is not None:
@@ -40,11 +59,25 @@ def main():
     # Extract the files into the current directory.
     for wheel_path in args.whl_paths:
         wheel = Wheel(wheel_path)
-        wheel.expand(args.directory)
+        with tracer.span(
+                wheel.basename(),
+                category='expand',
+                bytes=os.path.getsize(wheel_path)) as span_args:
+            span_args['uncompressed_bytes'] = wheel.expand(args.directory)
 
         copied_whl_path = os.path.join(args.directory,
                                        os.path.basename(wheel_path))
-        shutil.copy(wheel_path, copied_whl_path)
+        with tracer.span(wheel.basename(), category='copy'):
+            shutil.copy(wheel_path, copied_whl_path)
+
+        if args.native_store:
+            with tracer.span(
+                    wheel.basename(), category='dedupe_native') as span_args:
+                span_args['bytes'] = _dedupe_native_files(
+                    wheel, args.directory, args.native_store)
+
+        for name, reference in wheel.console_scripts().items():
+            console_scripts[name] = (wheel.distribution(), reference)
 
         if args.track_deps:
             for dependency in wheel.dependencies():
@@ -57,27 +90,63 @@ def main():
 
     # Generate BUILD file.
     dependency_join_str = ',\n        '
-    extras_join_str = '\n\n'
-
-    dependencies = dependency_join_str.join(dependency_list)
-    whl_dependencies = dependency_join_str.join(whl_dependency_list)
-    extras = extras_join_str.join(extra_list)
-    whl_extras = extras_join_str.join(whl_extra_list)
-
-    build_file_content = _make_build_file_content(
-        requirements_bzl=args.requirements,
-        dependencies=dependencies,
-        whl_dependencies=whl_dependencies,
-        extras=extras,
-        whl_extras=whl_extras)
 
-    with open(os.path.join(args.directory, 'BUILD'), 'w') as file_obj:
-        file_obj.write(build_file_content)
+    with tracer.span('generate_build') as span_args:
+        with open(os.path.join(args.directory, 'BUILD'), 'w') as file_obj:
+            _write_build_file(
+                file_obj.write,
+                requirements_bzl=args.requirements,
+                dependencies=dependency_join_str.join(dependency_list),
+                whl_dependencies=dependency_join_str.join(whl_dependency_list),
+                extras=extra_list,
+                whl_extras=whl_extra_list)
+            span_args['bytes'] = file_obj.tell()
+
+    if console_scripts:
+        with tracer.span('generate_console_scripts',
+                         scripts=len(console_scripts)):
+            _write_console_scripts(args.directory, console_scripts,
+                                   args.requirements)
+
+
+# See https://www.python.org/dev/peps/pep-0427/#file-name-convention
+_WHEEL_FILENAME = re.compile(r'''^(?P<distribution>[^-]+)
+                                 -(?P<version>[^-]+)
+                                 (-(?P<build>\d[^-]*))?
+                                 -(?P<python>[^-]+)
+                                 -(?P<abi>[^-]+)
+                                 -(?P<platform>[^-]+)
+                                 \.whl$''', re.VERBOSE)
+
+
+def parse_filename(basename):
+    """Parses a .whl filename per PEP 427.
+
+    Returns:
+      a dict with the distribution, version and (possibly None) build of the
+      wheel, and the set of (python, abi, platform) tags it supports, or
+      None if basename is not a well-formed wheel filename.
+    """
+    match = _WHEEL_FILENAME.match(basename)
+    if not match:
+        return None
+    # See https://www.python.org/dev/peps/pep-0425/#compressed-tag-sets
+    tags = frozenset((python, abi, platform_)
+                     for python in match.group('python').split('.')
+                     for abi in match.group('abi').split('.')
+                     for platform_ in match.group('platform').split('.'))
+    return {
+        'distribution': match.group('distribution'),
+        'version': match.group('version'),
+        'build': match.group('build'),
+        'tags': tags,
+    }
 
 
 class Wheel(object):
     def __init__(self, path):
         self._path = path
+        self._filename = None
 
     def path(self):
         return self._path
@@ -85,15 +154,29 @@ class Wheel(object):
     def basename(self):
         return os.path.basename(self.path())
 
+    def _parsed_filename(self):
+        if self._filename is None:
+            self._filename = parse_filename(self.basename()) or {
+                # Be lenient with names that are not quite PEP 427.
+                'distribution': self.basename().split('-')[0],
+                'version': self.basename().split('-')[1],
+                'build': None,
+                'tags': frozenset(),
+            }
+        return self._filename
+
     def distribution(self):
-        # See https://www.python.org/dev/peps/pep-0427/#file-name-convention
-        parts = self.basename().split('-')
-        return parts[0]
+        return self._parsed_filename()['distribution']
 
     def version(self):
-        # See https://www.python.org/dev/peps/pep-0427/#file-name-convention
-        parts = self.basename().split('-')
-        return parts[1]
+        return self._parsed_filename()['version']
+
+    def build(self):
+        return self._parsed_filename()['build']
+
+    def tags(self):
+        # The set of (python, abi, platform) tags this wheel supports.
+        return self._parsed_filename()['tags']
 
     def repository_name(self):
         # Returns the canonical name of the Bazel repository for this package.
@@ -125,6 +208,21 @@ class Wheel(object):
     def name(self):
         return self.metadata().get('name')
 
+    def requires_python(self):
+        """Returns the Requires-Python specifier of this Wheel, if any."""
+        with zipfile.ZipFile(self.path(), 'r') as whl:
+            try:
+                with whl.open(self._dist_info() + '/METADATA') as file_obj:
+                    content = file_obj.read().decode("utf-8")
+            except KeyError:
+                return None
+        # The headers end at the first blank line, where the description
+        # starts.
+        for line in content.split('\n\n', 1)[0].splitlines():
+            if line.lower().startswith('requires-python:'):
+                return line.split(':', 1)[1].strip() or None
+        return None
+
     def dependencies(self, extra=None):
         """Access the dependencies of this Wheel.
 
@@ -142,28 +240,347 @@ class Wheel(object):
                 # Match the requirements for the extra we're looking for.
                 continue
             marker = requirement.get('environment')
-            if marker and not pkg_resources.evaluate_marker(marker):
+            if marker and not pkg_resources.packaging.markers.Marker(
+                    marker).evaluate({'extra': extra or ''}):
                 # The current environment does not match the provided PEP 508 marker,
                 # so ignore this requirement.
                 continue
             requires = requirement.get('requires', [])
             for entry in requires:
-                # Strip off any trailing versioning data.
-                parts = re.split('[ ><=()]', entry)
-                yield parts[0]
+                # Strip off any versioning data, keeping the extras.
+                req = pkg_resources.Requirement.parse(entry)
+                if req.extras:
+                    yield '{}[{}]'.format(req.project_name,
+                                          ','.join(req.extras))
+                else:
+                    yield req.project_name
 
     def extras(self):
         return self.metadata().get('extras', [])
 
+    def entry_points(self):
+        """Parses the entry_points.txt in the WHL's dist-info directory.
+
+        Returns:
+          a dict keyed by entry point group (e.g. "console_scripts"), whose
+          values are dicts from entry point name to its "module:attr" object
+          reference.
+        """
+        with zipfile.ZipFile(self.path(), 'r') as whl:
+            try:
+                with whl.open(
+                        self._dist_info() + '/entry_points.txt') as file_obj:
+                    content = file_obj.read().decode("utf-8")
+            except KeyError:
+                return {}
+        return _parse_entry_points(content)
+
+    def console_scripts(self):
+        return self.entry_points().get('console_scripts', {})
+
+    def native_files(self):
+        # The names of the native libraries and extensions in this Wheel.
+        with zipfile.ZipFile(self.path(), 'r') as whl:
+            return [
+                name for name in whl.namelist()
+                if not name.endswith('/') and _classify(name) == 'native'
+            ]
+
     def expand(self, directory):
+        """Extracts the contents of this Wheel into directory.
+
+        Returns:
+          the total uncompressed size in bytes of the extracted files.
+        """
         with zipfile.ZipFile(self.path(), 'r') as whl:
             whl.extractall(directory)
+            return sum(info.file_size for info in whl.infolist())
+
+    def inspect(self, depth=2):
+        """Summarizes the size of this Wheel's contents, without extracting.
+
+        The sizes are read from the central directory of the .whl file.
+
+        Args:
+          depth: the number of leading path components by which to group
+            files into directories.
+
+        Returns:
+          a dict of file counts and uncompressed byte counts, in total, by
+          kind of file (see _classify) and by directory.
+        """
+        summary = _new_summary()
+        summary['wheel'] = self.basename()
+        summary['compressed_bytes'] = 0
+        summary['directories'] = {}
+        with zipfile.ZipFile(self.path(), 'r') as whl:
+            for info in whl.infolist():
+                if info.filename.endswith('/'):
+                    continue
+                summary['compressed_bytes'] += info.compress_size
+                _add_to_summary(summary, info.filename, info.file_size)
+                directory = '/'.join(info.filename.split('/')[:-1][:depth])
+                entry = summary['directories'].setdefault(
+                    directory or '.', {'files': 0, 'bytes': 0})
+                entry['files'] += 1
+                entry['bytes'] += info.file_size
+        return summary
 
     # _parse_metadata parses METADATA files according to https://www.python.org/dev/peps/pep-0314/
     def _parse_metadata(self, content):
-        # TODO: handle fields other than just name
+        """Parses the METADATA file into the structure of metadata.json.
+
+        Only the name, extras and run_requires are extracted, with the latter
+        grouped by extra and environment marker.  A requirement is listed
+        under each extra that its marker names, with the whole marker, which
+        is evaluated for that extra.
+        """
         name_pattern = re.compile('Name: (.*)')
-        return {'name': name_pattern.search(content).group(1)}
+        metadata = {'name': name_pattern.search(content).group(1)}
+        extras = []
+        run_requires = []
+        # The headers end at the first blank line, where the description
+        # starts.
+        for line in content.split('\n\n', 1)[0].splitlines():
+            key, _, value = line.partition(':')
+            key = key.strip().lower()
+            value = value.strip()
+            if key == 'provides-extra':
+                extras.append(value)
+            elif key == 'requires-dist':
+                requirement, _, marker = value.partition(';')
+                marker = marker.strip() or None
+                for extra in _EXTRA_MARKER.findall(marker or '') or [None]:
+                    _add_run_requirement(run_requires, requirement.strip(),
+                                         extra, marker)
+        if extras:
+            metadata['extras'] = extras
+        if run_requires:
+            metadata['run_requires'] = run_requires
+        return metadata
+
+
+# Matches the "extra == 'name'" clauses of a marker.
+_EXTRA_MARKER = re.compile(r'''\bextra\s*==\s*['"]([^'"]*)['"]''')
+
+
+def _add_run_requirement(run_requires, requirement, extra, marker):
+    for entry in run_requires:
+        if entry.get('extra') == extra and entry.get('environment') == marker:
+            entry['requires'].append(requirement)
+            return
+    entry = {'requires': [requirement]}
+    if extra:
+        entry['extra'] = extra
+    if marker:
+        entry['environment'] = marker
+    run_requires.append(entry)
+
+
+def select_wheels(wheels, supported_tags, python_version=None):
+    """Selects the best compatible wheel for each distribution.
+
+    Args:
+      wheels: a list of Wheel objects.
+      supported_tags: the (python, abi, platform) tags supported by the
+        target interpreter, most preferred first (as returned by pip's
+        pep425tags.get_supported()).
+      python_version: the version of the target interpreter, against which
+        to check Requires-Python; defaults to the current one.
+
+    Returns:
+      a pair of lists of Wheel objects: those selected, at most one per
+      distribution, and those rejected, each with the reason why.
+    """
+    python_version = python_version or platform.python_version()
+    rank = {}
+    for index, tag in enumerate(supported_tags):
+        rank.setdefault(tuple(tag), index)
+
+    candidates = {}
+    rejected = []
+    for wheel in wheels:
+        ranks = [rank[tag] for tag in wheel.tags() if tag in rank]
+        if not ranks:
+            rejected.append((wheel, 'no supported tag'))
+            continue
+        requires_python = wheel.requires_python()
+        if requires_python and not _satisfies(python_version,
+                                              requires_python):
+            rejected.append(
+                (wheel, 'requires Python {}'.format(requires_python)))
+            continue
+        candidates.setdefault(normalize_name(wheel.distribution()), []).append(
+            (wheel, min(ranks)))
+
+    selected = []
+    for key in sorted(candidates):
+        # Prefer the newest version, then the most specific tag, then the
+        # latest build.
+        ordered = sorted(
+            candidates[key],
+            key=lambda candidate: (
+                pkg_resources.parse_version(candidate[0].version()),
+                -candidate[1],
+                _build_key(candidate[0].build())),
+            reverse=True)
+        selected.append(ordered[0][0])
+        rejected.extend((wheel, 'superseded by {}'.format(
+            ordered[0][0].basename())) for wheel, _ in ordered[1:])
+    return selected, rejected
+
+
+def _satisfies(python_version, requires_python):
+    try:
+        requirement = pkg_resources.Requirement.parse(
+            'python' + requires_python)
+    except ValueError:
+        # Be lenient with malformed specifiers, as pip is.
+        return True
+    return python_version in requirement
+
+
+def _build_key(build):
+    # See https://www.python.org/dev/peps/pep-0427/#file-name-convention
+    if not build:
+        return (-1, '')
+    match = re.match(r'(\d+)(.*)', build)
+    return (int(match.group(1)), match.group(2))
+
+
+def normalize_name(name):
+    """Returns the normalized form of a distribution's name.
+
+    See https://www.python.org/dev/peps/pep-0503/#normalized-names; the
+    generated requirements.bzl normalizes names the same way.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+
+_NATIVE_SUFFIXES = ('.so', '.pyd', '.dylib')
+_TEST_DIRS = frozenset(['test', 'tests', 'testing'])
+_DOC_DIRS = frozenset(['doc', 'docs', 'example', 'examples'])
+_DOC_SUFFIXES = ('.rst', '.md', '.html')
+
+
+def _classify(filename):
+    """Returns the kind of a file within a wheel.
+
+    One of "native" (shared libraries and extension modules), "test" and
+    "doc" (files that are not needed at runtime, by directory or suffix),
+    "python" or "other".
+    """
+    parts = filename.split('/')
+    basename = parts[-1]
+    if basename.endswith(_NATIVE_SUFFIXES) or '.so.' in basename:
+        return 'native'
+    if (_TEST_DIRS.intersection(parts[:-1]) or basename.startswith('test_') or
+            basename.endswith('_test.py')):
+        return 'test'
+    if _DOC_DIRS.intersection(parts[:-1]) or basename.endswith(_DOC_SUFFIXES):
+        return 'doc'
+    if basename.endswith(('.py', '.pyc')):
+        return 'python'
+    return 'other'
+
+
+def _new_summary():
+    summary = {'files': 0, 'bytes': 0}
+    for kind in ('native', 'test', 'doc', 'python', 'other'):
+        summary[kind + '_files'] = 0
+        summary[kind + '_bytes'] = 0
+    return summary
+
+
+def _add_to_summary(summary, filename, size):
+    kind = _classify(filename)
+    summary['files'] += 1
+    summary['bytes'] += size
+    summary[kind + '_files'] += 1
+    summary[kind + '_bytes'] += size
+
+
+def _dedupe_native_files(wheel, directory, store):
+    """Hard links the native files of an expanded wheel into store.
+
+    Manylinux wheels often bundle identical copies of the same shared
+    libraries (e.g. libgfortran).  Each distinct file is kept once in store,
+    named by its sha256, and every expanded copy is replaced by a hard link
+    to it.  Files that cannot be linked (e.g. across file systems) are left
+    as they are.
+
+    Returns:
+      the number of bytes that were replaced by links to existing copies.
+    """
+    if not os.path.isdir(store):
+        try:
+            os.makedirs(store)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    saved = 0
+    for name in wheel.native_files():
+        path = os.path.join(directory, name)
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file_obj:
+            for chunk in iter(lambda: file_obj.read(1 << 20), b''):
+                digest.update(chunk)
+        stored = os.path.join(store, digest.hexdigest())
+        try:
+            # The first copy seen becomes the stored one.
+            os.link(path, stored)
+            continue
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                continue
+        if os.path.samefile(path, stored):
+            continue
+        linked = path + '.dedupe'
+        try:
+            os.link(stored, linked)
+        except OSError:
+            continue
+        os.rename(linked, path)
+        saved += os.path.getsize(path)
+    return saved
+
+
+def inspect_wheels(wheels, depth=2):
+    """Summarizes the contents of wheels, per wheel and in total.
+
+    Returns:
+      a dict with the Wheel.inspect summary of each wheel, ordered by
+      decreasing size, and their totals.
+    """
+    summaries = sorted(
+        [wheel.inspect(depth=depth) for wheel in wheels],
+        key=lambda summary: (-summary['bytes'], summary['wheel']))
+    totals = _new_summary()
+    totals['compressed_bytes'] = 0
+    for summary in summaries:
+        for key in totals:
+            totals[key] += summary[key]
+    return {'wheels': summaries, 'totals': totals}
+
+
+def _parse_entry_points(content):
+    # See https://packaging.python.org/specifications/entry-points/#file-format
+    groups = {}
+    group = None
+    for line in content.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            group = groups.setdefault(line[1:-1].strip(), {})
+            continue
+        if group is None or '=' not in line:
+            continue
+        name, value = line.split('=', 1)
+        # Drop any trailing [extras]; the extras are not needed to resolve
+        # the object reference.
+        group[name.strip()] = value.split('[', 1)[0].strip()
+    return groups
 
 
 def _parse_args():
@@ -199,8 +616,35 @@ def _parse_args():
     parser.add_argument(
         '--extras',
         action='append',
+        default=[],
         help='The set of extras for which to generate library targets.')
 
+    parser.add_argument(
+        '--native_store',
+        action='store',
+        default=None,
+        help=('A directory shared by all wheel repositories, through which to '
+              'hard link identical native libraries.'))
+
+    parser.add_argument(
+        '--inspect',
+        action='store_true',
+        help=('Print the sizes of the contents of the .whl files as JSON, '
+              'rather than expanding them.'))
+
+    parser.add_argument(
+        '--inspect_depth',
+        action='store',
+        type=int,
+        default=2,
+        help='The directory depth by which --inspect groups files.')
+
+    parser.add_argument(
+        '--trace',
+        action='store',
+        default=None,
+        help='The file to which to write a Chrome trace of the expansion.')
+
     return parser.parse_args()
 
 
@@ -231,7 +675,7 @@ def _make_extra(extra, wheel):
 
 
 def _make_whl_extra(extra, wheel):
-    _WHL_EXTRA_TEMPLATE.format(
+    return _WHL_EXTRA_TEMPLATE.format(
         extra=extra,
         deps=','.join([
             'pypi_whl_requirement("%s")' % dep
@@ -240,8 +684,142 @@ def _make_whl_extra(extra, wheel):
     )
 
 
-def _make_build_file_content(requirements_bzl, dependencies, whl_dependencies,
-                             extras, whl_extras):
+_CONSOLE_SCRIPTS_PACKAGE = 'console_scripts'
+
+# Unlike the launchers generated by pip, these import the entry point
+# directly rather than resolving it through pkg_resources, which scans
+# every distribution on sys.path at startup.
+_CONSOLE_SCRIPT_TEMPLATE = textwrap.dedent("""\
+    # Generated by whltool from the console_scripts entry point:
+    #   {name} = {reference}
+    import sys
+
+    from {module} import {head}
+
+    if __name__ == "__main__":
+        sys.exit({call}())
+""")
+
+# Python puts the directory of the main file first on sys.path, so the
+# launchers are named such that they cannot shadow the package of the entry
+# point (e.g. flake8 = flake8.main.cli:main).
+_CONSOLE_SCRIPT_LAUNCHER = '_launch_{name}.py'
+
+_CONSOLE_SCRIPT_BINARY_TEMPLATE = textwrap.dedent("""\
+    py_binary(
+        name = "{name}",
+        srcs = ["{launcher}"],
+        main = "{launcher}",
+        deps = [{dep}],
+    )
+""")
+
+
+def _write_console_scripts(directory, console_scripts, requirements_bzl=None):
+    """Writes a py_binary launcher for each console script.
+
+    The launchers live in their own package, so that they neither clash
+    with the names of the top-level targets nor get globbed into :pkg.
+
+    Args:
+      directory: the root of the expanded repository.
+      console_scripts: a dict from script name to a tuple of the name of the
+        distribution declaring it and its "module:attr" reference.
+      requirements_bzl: the label of the requirements.bzl of the
+        pip_import, if any.  The launchers then depend on the transitive
+        closure of their distribution, rather than on its :pkg alone.
+    """
+    package = os.path.join(directory, _CONSOLE_SCRIPTS_PACKAGE)
+    if os.path.exists(package):
+        print('Not generating console_scripts launchers: {} already exists'
+              .format(package))
+        return
+    os.makedirs(package)
+
+    binaries = []
+    for name, (distribution, reference) in sorted(console_scripts.items()):
+        module, _, attr = reference.partition(':')
+        if not attr:
+            # A console script must name a callable within the module.
+            continue
+        head = attr.split('.')[0]
+        launcher = _CONSOLE_SCRIPT_LAUNCHER.format(name=name)
+        with open(os.path.join(package, launcher), 'w') as file_obj:
+            file_obj.write(
+                _CONSOLE_SCRIPT_TEMPLATE.format(
+                    name=name,
+                    reference=reference,
+                    module=module.strip(),
+                    head=head.strip(),
+                    call=attr.strip()))
+        if requirements_bzl:
+            dep = 'pypi_requirement("{}")'.format(distribution)
+        else:
+            dep = '"//:pkg"'
+        binaries.append(
+            _CONSOLE_SCRIPT_BINARY_TEMPLATE.format(
+                name=name, launcher=launcher, dep=dep))
+
+    with open(os.path.join(package, 'BUILD'), 'w') as file_obj:
+        file_obj.write('package(default_visibility = ["//visibility:public"])'
+                       '\n\n')
+        if requirements_bzl:
+            file_obj.write('load("{}", "pypi_requirement")\n\n'.format(
+                requirements_bzl))
+        file_obj.write('\n'.join(binaries))
+
+
+# The extras and whl_extras, each separated by a blank line, follow.
+_BUILD_TEMPLATE = textwrap.dedent("""\
+    package(default_visibility = ["//visibility:public"])
+
+    {load_requirements_statement}
+
+    _NATIVE = ["**/*.so", "**/*.so.*", "**/*.pyd", "**/*.dylib"]
+
+    # The Python sources and data files of the wheels.
+    py_library(
+        name = "py",
+        srcs = glob(["**/*.py"]),
+        data = glob(["**/*"], exclude=["**/*.py", "**/* *", "BUILD", "WORKSPACE", "**/*.whl", "trace.json"] + _NATIVE),
+        # This makes this directory a top-level in the python import
+        # search path for anything that depends on this.
+        imports = ["."],
+        deps = [{dependencies}],
+    )
+
+    # The shared libraries and extension modules of the wheels.
+    filegroup(
+        name = "native",
+        srcs = glob(_NATIVE),
+    )
+
+    py_library(
+        name = "pkg",
+        data = [":native"],
+        deps = [":py"],
+    )
+
+    filegroup(
+        name = "whl",
+        srcs = glob(["**/*.whl"]) + [{whl_dependencies}],
+    )
+
+""")
+
+
+def _write_build_file(write, requirements_bzl, dependencies, whl_dependencies,
+                      extras, whl_extras):
+    """Writes the BUILD file through write, one rule at a time.
+
+    Args:
+      write: a callable taking each successive chunk of the file.
+      requirements_bzl: the label of the requirements.bzl to load, if any.
+      dependencies: the deps of the py target.
+      whl_dependencies: the srcs of the whl target, besides its own wheels.
+      extras: a list of the py_library rules of the extras.
+      whl_extras: a list of the filegroup rules of the extras.
+    """
     if requirements_bzl:
         template = (
             'load("{requirements_bzl}", "requirement", "pypi_whl_requirement")'
@@ -251,36 +829,22 @@ def _make_build_file_content(requirements_bzl, dependencies, whl_dependencies,
     else:
         load_requirements_statement = ''
 
-    return textwrap.dedent("""\
-        package(default_visibility = ["//visibility:public"])
-
-        {load_requirements_statement}
-
-        py_library(
-            name = "pkg",
-            srcs = glob(["**/*.py"]),
-            data = glob(["**/*"], exclude=["**/*.py", "**/* *", "BUILD", "WORKSPACE", "**/*.whl"]),
-            # This makes this directory a top-level in the python import
-            # search path for anything that depends on this.
-            imports = ["."],
-            deps = [{dependencies}],
-        )
-
-        filegroup(
-            name = "whl",
-            srcs = glob(["**/*.whl"]) + [{whl_dependencies}],
-        )
-
-        {extras}
-
-        {whl_extras}
-    """).format(
-        requirements_bzl=requirements_bzl,
-        dependencies=dependencies,
-        whl_dependencies=whl_dependencies,
-        extras=extras,
-        whl_extras=whl_extras,
-        load_requirements_statement=load_requirements_statement)
+    write(
+        _BUILD_TEMPLATE.format(
+            load_requirements_statement=load_requirements_statement,
+            dependencies=dependencies,
+            whl_dependencies=whl_dependencies))
+    _write_rules(write, extras)
+    write('\n\n')
+    _write_rules(write, whl_extras)
+    write('\n')
+
+
+def _write_rules(write, rules):
+    for index, rule in enumerate(rules):
+        if index:
+            write('\n\n')
+        write(rule)
 
 
 if __name__ == '__main__':
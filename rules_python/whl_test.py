@@ -13,10 +13,13 @@
 # limitations under the License.
 
 import os
+import subprocess
+import sys
 import unittest
 
 from mock import patch
 
+from rules_python import testutil
 from rules_python import whl
 
 
@@ -24,7 +27,7 @@ def TestData(name):
     return os.path.join(os.environ['TEST_SRCDIR'], name)
 
 
-class WheelTest(unittest.TestCase):
+class WheelTest(testutil.WheelTestCase):
     def test_grpc_whl(self):
         td = TestData(
             'grpc_whl/file/grpcio-1.6.0-cp27-cp27m-manylinux1_i686.whl')
@@ -123,6 +126,178 @@ class WheelTest(unittest.TestCase):
         ]
         self.assertEqual(set(wheel.dependencies()), set(expected_deps))
 
+    def test_console_scripts(self):
+        wheel = self.make_wheel(
+            'tool-1.0-py2.py3-none-any.whl',
+            files={
+                'tool/__init__.py':
+                '',
+                'tool/cli.py':
+                'def main():\n'
+                '    print("main")\n'
+                '    return 3\n'
+                '\n'
+                'class Runner(object):\n'
+                '    @staticmethod\n'
+                '    def run():\n'
+                '        print("run")\n'
+                '        return 3\n',
+                'tool-1.0.dist-info/entry_points.txt':
+                '[console_scripts]\n'
+                'tool = tool.cli:main\n'
+                'tool-dev = tool.cli:Runner.run [dev]\n'
+                '\n'
+                '[tool.plugins]\n'
+                'default = tool.plugins\n',
+            })
+        self.assertEqual({
+            'tool': 'tool.cli:main',
+            'tool-dev': 'tool.cli:Runner.run',
+        }, wheel.console_scripts())
+        self.assertEqual({'default': 'tool.plugins'},
+                         wheel.entry_points()['tool.plugins'])
+
+        wheel.expand(self.tmpdir)
+        whl._write_console_scripts(
+            self.tmpdir, {
+                name: (wheel.distribution(), reference)
+                for name, reference in wheel.console_scripts().items()
+            })
+        with open(os.path.join(self.tmpdir, 'console_scripts',
+                               '_launch_tool-dev.py')) as file_obj:
+            self.assertNotIn('pkg_resources', file_obj.read())
+        with open(os.path.join(self.tmpdir, 'console_scripts',
+                               'BUILD')) as file_obj:
+            build = file_obj.read()
+        self.assertIn('name = "tool",', build)
+        self.assertIn('main = "_launch_tool-dev.py",', build)
+        self.assertIn('deps = ["//:pkg"],', build)
+
+        # Run the launchers as py_binary would, with the repository on
+        # the import path.
+        env = dict(os.environ, PYTHONPATH=self.tmpdir)
+        for name, output in [('tool', 'main'), ('tool-dev', 'run')]:
+            process = subprocess.Popen(
+                [
+                    sys.executable,
+                    os.path.join(self.tmpdir, 'console_scripts',
+                                 '_launch_{}.py'.format(name))
+                ],
+                stdout=subprocess.PIPE,
+                env=env)
+            stdout, _ = process.communicate()
+            self.assertEqual(output, stdout.decode('utf-8').strip())
+            self.assertEqual(3, process.returncode)
+
+    def test_inspect(self):
+        wheel = self.make_wheel(
+            'big-1.0-cp36-cp36m-manylinux1_x86_64.whl',
+            files={
+                'big/__init__.py': 'x' * 10,
+                'big/_speedups.cpython-36m.so': 'x' * 100,
+                'big/.libs/libopenblas.so.0': 'x' * 1000,
+                'big/tests/test_big.py': 'x' * 20,
+                'big/docs/index.rst': 'x' * 30,
+            })
+        summary = whl.inspect_wheels([wheel])
+        totals = summary['totals']
+        self.assertEqual(5, totals['files'])
+        self.assertEqual(1160, totals['bytes'])
+        self.assertEqual(1100, totals['native_bytes'])
+        self.assertEqual(2, totals['native_files'])
+        self.assertEqual(20, totals['test_bytes'])
+        self.assertEqual(30, totals['doc_bytes'])
+        self.assertEqual(10, totals['python_bytes'])
+        self.assertEqual({
+            'files': 1,
+            'bytes': 1000
+        }, summary['wheels'][0]['directories']['big/.libs'])
+
+    def test_parse_filename(self):
+        parsed = whl.parse_filename(
+            'grpcio-1.6.0-1b-cp27-cp27m.cp27mu-manylinux1_i686.whl')
+        self.assertEqual('grpcio', parsed['distribution'])
+        self.assertEqual('1.6.0', parsed['version'])
+        self.assertEqual('1b', parsed['build'])
+        self.assertEqual(
+            set([('cp27', 'cp27m', 'manylinux1_i686'),
+                 ('cp27', 'cp27mu', 'manylinux1_i686')]), parsed['tags'])
+        self.assertIsNone(whl.parse_filename('grpcio-1.6.0.tar.gz'))
+
+    def test_select_wheels(self):
+        def make_wheel(basename, requires_python=None):
+            headers = []
+            if requires_python:
+                headers.append('Requires-Python: {}'.format(requires_python))
+            return self.make_wheel(
+                basename,
+                headers,
+                description='Requires-Python: in the description\n')
+
+        supported = [('cp36', 'cp36m', 'manylinux1_x86_64'),
+                     ('cp36', 'none', 'any'), ('py3', 'none', 'any')]
+        native = make_wheel('fast-1.0-cp36-cp36m-manylinux1_x86_64.whl')
+        pure = make_wheel('fast-1.0-py3-none-any.whl')
+        old = make_wheel('fast-0.9-cp36-cp36m-manylinux1_x86_64.whl')
+        windows = make_wheel('win-1.0-cp36-cp36m-win_amd64.whl')
+        py2_only = make_wheel('legacy-2.0-py3-none-any.whl', '<3')
+        py3 = make_wheel('modern-1.0-py3-none-any.whl', '>=3.4')
+
+        selected, rejected = whl.select_wheels(
+            [pure, old, native, windows, py2_only, py3],
+            supported_tags=supported,
+            python_version='3.6.3')
+        self.assertEqual([native, py3], selected)
+        self.assertEqual(
+            set([pure, old, windows, py2_only]),
+            set(wheel for wheel, _ in rejected))
+
+    def test_dedupe_native_files(self):
+        store = os.path.join(self.tmpdir, 'store')
+        directories = []
+        for name in ['scipy', 'numpy']:
+            wheel = self.make_wheel(
+                '{}-1.0-cp36-cp36m-manylinux1_x86_64.whl'.format(name),
+                files={
+                    '{}/.libs/libgfortran.so.3'.format(name): 'x' * 100,
+                    '{}/__init__.py'.format(name): name,
+                })
+            self.assertEqual(['{}/.libs/libgfortran.so.3'.format(name)],
+                             wheel.native_files())
+            directory = os.path.join(self.tmpdir, name)
+            wheel.expand(directory)
+            directories.append(directory)
+            saved = whl._dedupe_native_files(wheel, directory, store)
+        self.assertEqual(100, saved)
+        self.assertTrue(
+            os.path.samefile(
+                os.path.join(directories[0], 'scipy/.libs/libgfortran.so.3'),
+                os.path.join(directories[1], 'numpy/.libs/libgfortran.so.3')))
+        self.assertEqual(1, len(os.listdir(store)))
+
+    @patch('platform.python_version', return_value='3.6.3')
+    def test_METADATA_requirements(self, *args):
+        wheel = self.make_wheel(
+            'requests-2.18.4-py2.py3-none-any.whl', [
+                'Requires-Dist: idna (<2.7,>=2.5)',
+                'Requires-Dist: urllib3~=1.21',
+                'Requires-Dist: win-inet-pton; sys_platform == "win32"',
+                'Provides-Extra: socks',
+                'Requires-Dist: PySocks!=1.5.7,>=1.5.6; extra == \'socks\'',
+                'Requires-Dist: ipaddress; python_version < "3" and '
+                'extra == "socks"',
+                'Provides-Extra: security',
+                'Requires-Dist: cryptography[ssl]>=1.3.4; '
+                'extra == "socks" or extra == "security"',
+            ],
+            description='Requires-Dist: in the description\n')
+        self.assertEqual(['socks', 'security'], wheel.extras())
+        self.assertEqual(['idna', 'urllib3'], list(wheel.dependencies()))
+        self.assertEqual(['PySocks', 'cryptography[ssl]'],
+                         list(wheel.dependencies(extra='socks')))
+        self.assertEqual(['cryptography[ssl]'],
+                         list(wheel.dependencies(extra='security')))
+
 
 if __name__ == '__main__':
     unittest.main()